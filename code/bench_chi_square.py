@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+from scipy.stats import chisquare
+
+from detect_lsb import chi_square_test
+
+# Bit counts to benchmark (MAX_BITS default, then larger budgets)
+SIZES = [10_000, 1_000_000, 10_000_000]
+
+# The per-block loop is slow, so only time it up to this size
+LOOP_LIMIT = 1_000_000
+
+
+def chi_square_test_loop(lsb_array, block_size=32):
+    """
+    Reference per-block implementation (one scipy call per block).
+    Kept here to check the vectorized chi_square_test against.
+    """
+    n = len(lsb_array)
+    n_blocks = n // block_size
+    trimmed = lsb_array[:n_blocks * block_size].reshape(n_blocks, block_size)
+
+    chi_values = []
+    p_values = []
+    bias_values = []
+
+    for block in trimmed:
+        counts = np.bincount(block, minlength=2)
+        total = counts.sum()
+        expected = [total * 0.5, total * 0.5]
+        chi, p = chisquare(counts, f_exp=expected)
+
+        chi_values.append(chi)
+        p_values.append(p)
+
+        prop_1 = counts[1] / total if total > 0 else 0.0
+        bias_values.append(abs(prop_1 - 0.5))
+
+    chi_values = np.array(chi_values)
+    p_values = np.array(p_values)
+    bias_values = np.array(bias_values)
+
+    return (
+        float(chi_values.mean()),
+        float(chi_values.std()),
+        float((p_values < 0.05).mean()),
+        float(bias_values.mean()),
+    )
+
+
+def time_call(func, *args, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print(f"{'bits':>12s} {'vectorized (s)':>15s} {'loop (s)':>10s} {'speedup':>9s}")
+    for size in SIZES:
+        # Slightly biased bits so some blocks are significant
+        lsbs = (rng.random(size) < 0.6).astype(np.uint8)
+
+        vec_time, vec_result = time_call(chi_square_test, lsbs)
+
+        if size <= LOOP_LIMIT:
+            loop_time, loop_result = time_call(chi_square_test_loop, lsbs, repeat=1)
+            if not np.allclose(vec_result, loop_result, rtol=1e-12, atol=1e-12):
+                raise AssertionError(
+                    f"Mismatch at {size} bits: {vec_result} != {loop_result}"
+                )
+            speedup = f"{loop_time / vec_time:8.1f}x"
+            loop_str = f"{loop_time:10.4f}"
+        else:
+            speedup = "-"
+            loop_str = "-"
+
+        print(f"{size:12d} {vec_time:15.4f} {loop_str:>10s} {speedup:>9s}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import detect_lsb
+import run_analysis
+from detect_lsb import (
+    analyze_batch,
+    analyze_image,
+    build_baseline_profile,
+    chi_square_test,
+    extract_lsb,
+    load_image,
+    rs_analysis,
+    sample_pair_stat,
+    spa_rate,
+    suspicious_score,
+)
+from generate_stego_png import PAYLOAD_RATIOS, embed_random_lsb_png, stego_name
+
+PROJECT = Path(__file__).resolve().parents[1]
+
+# Results of the last run, and the stored baseline they are compared with.
+# Timings are machine-specific, so neither is committed: store a baseline
+# on the machine that runs the comparison with --save-baseline
+BENCH_JSON = PROJECT / "results" / "bench_results.json"
+BENCH_BASELINE = PROJECT / "results" / "bench_baseline.json"
+
+# Synthetic image sizes (width, height)
+SIZES = {
+    "small": (128, 128),
+    "medium": (640, 480),
+    "large": (1920, 1080),
+}
+
+# Clean images generated per size; each also gets one stego image per payload
+IMAGES_PER_SIZE = 4
+
+# Times every stage runs over every image (latency samples per stage)
+REPEAT = 3
+
+# A stage regresses when its median latency grows by more than this share,
+# and by at least REGRESSION_MIN_MS (microsecond stages are mostly timer noise)
+REGRESSION_THRESHOLD = 0.25
+REGRESSION_MIN_MS = 0.05
+
+# Latency percentiles reported per stage
+PERCENTILES = (50, 90, 99)
+
+SEED = 0
+
+
+# -------------------------------
+# Synthetic Corpus
+# -------------------------------
+def synthetic_image(rng, width, height):
+    """
+    Camera-like BGR test image: smooth gradients and blobs plus sensor
+    noise, so neighboring pixels are correlated the way RS and SPA expect
+    (pure noise would look like a fully embedded image).
+    """
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    img = np.empty((height, width, 3), dtype=np.float64)
+    for c in range(3):
+        fx, fy = rng.uniform(0.5, 3.0, size=2) * 2 * np.pi
+        phase = rng.uniform(0, 2 * np.pi)
+        img[:, :, c] = 128 + 60 * np.sin(fx * x / width + phase) * np.cos(fy * y / height)
+        for _ in range(4):
+            cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+            radius = rng.uniform(0.05, 0.3) * min(width, height)
+            img[:, :, c] += rng.uniform(-50, 50) * np.exp(
+                -((x - cx) ** 2 + (y - cy) ** 2) / (2 * radius ** 2)
+            )
+    img += rng.normal(0, 2.0, size=img.shape)
+    return np.clip(np.rint(img), 0, 255).astype(np.uint8)
+
+
+def build_corpus(root, sizes, per_size=IMAGES_PER_SIZE, seed=SEED):
+    """
+    Write clean PNGs under root/clean and their stego variants (via
+    embed_random_lsb_png) under root/stego/<label>, in the layout
+    run_analysis expects. Returns {size name: [(path, label), ...]}.
+    """
+    rng = np.random.default_rng(seed)
+    clean_dir = Path(root) / "clean"
+    clean_dir.mkdir(parents=True, exist_ok=True)
+
+    corpus = {}
+    for name in sizes:
+        width, height = SIZES[name]
+        images = []
+        for i in range(per_size):
+            clean_path = clean_dir / f"{name}{i:03d}.png"
+            cv2.imwrite(str(clean_path), synthetic_image(rng, width, height))
+            images.append((clean_path, "clean"))
+
+            for label, ratio in PAYLOAD_RATIOS.items():
+                stego_path = Path(root) / "stego" / label / stego_name(clean_path, label)
+                embed_random_lsb_png(clean_path, stego_path, ratio)
+                images.append((stego_path, label))
+        corpus[name] = images
+    return corpus
+
+
+# -------------------------------
+# Measurement
+# -------------------------------
+def reset_peak_rss():
+    """Reset the process peak RSS (Linux only); False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(samples, n_images):
+    """Latency percentiles (ms), mean and images/sec of one stage's samples."""
+    samples = np.asarray(samples, dtype=np.float64)
+    total = samples.sum()
+    out = {
+        "n": int(samples.size),
+        "mean_ms": float(samples.mean() * 1e3),
+        "images_per_s": float(n_images / total) if total > 0 else None,
+    }
+    for p in PERCENTILES:
+        out[f"p{p}_ms"] = float(np.percentile(samples, p) * 1e3)
+    return out
+
+
+def time_stage(func, inputs, repeat=REPEAT):
+    """
+    Run func over every input `repeat` times, after one untimed warm-up
+    call; returns the stage summary.
+    """
+    func(*inputs[0])
+    reset_peak_rss()
+    samples = []
+    for _ in range(repeat):
+        for args in inputs:
+            start = time.perf_counter()
+            func(*args)
+            samples.append(time.perf_counter() - start)
+    stats = summarize(samples, len(samples))
+    stats["peak_rss_mb"] = peak_rss_mb()
+    return stats
+
+
+# -------------------------------
+# Benchmarks
+# -------------------------------
+def bench_detectors(images, profile, repeat=REPEAT):
+    """
+    Latency of every detector on one size's images. Each stage gets the
+    images already decoded (and the LSBs already extracted), so stages
+    do not include each other; "decode" and "analyze_file" (decode plus
+    every run_analysis detector) cover the whole per-image path.
+    """
+    paths = [path for path, _ in images]
+    decoded = [load_image(path) for path in paths]
+    lsbs = [extract_lsb(img) for img in decoded]
+
+    stages = {
+        "decode": (load_image, [(p,) for p in paths]),
+        "extract_lsb": (extract_lsb, [(img,) for img in decoded]),
+        "chi_square_test": (chi_square_test, [(lsb,) for lsb in lsbs]),
+        "rs_analysis": (rs_analysis, [(img,) for img in decoded]),
+        "sample_pair_stat": (sample_pair_stat, [(lsb,) for lsb in lsbs]),
+        "spa_rate": (spa_rate, [(img[:, :, 0],) for img in decoded]),
+        "suspicious_score": (
+            partial(suspicious_score, profile=profile),
+            [(lsb, img) for lsb, img in zip(lsbs, decoded)],
+        ),
+        "analyze_image": (analyze_image, [(img,) for img in decoded]),
+        "analyze_file": (run_analysis.analyze_file, [(p,) for p in paths]),
+    }
+    results = {name: time_stage(func, inputs, repeat) for name, (func, inputs) in stages.items()}
+
+    # The whole batch in one call, reported per image
+    batch = time_stage(analyze_batch, [(decoded,)], repeat)
+    for key in ("mean_ms", *(f"p{p}_ms" for p in PERCENTILES)):
+        batch[key] /= len(decoded)
+    batch["images_per_s"] *= len(decoded)
+    results["analyze_batch"] = batch
+    return results
+
+
+@contextlib.contextmanager
+def pipeline_in(root):
+    """
+    Point run_analysis at a corpus under `root` and keep every file it
+    writes (results, cache, manifest, baseline profile) there too. The
+    profile path is redirected in detect_lsb itself, so anything that
+    reads or writes the default profile during the run uses the copy.
+    """
+    root = Path(root)
+    out = root / "results"
+    out.mkdir(parents=True, exist_ok=True)
+    redirect = {
+        "CLEAN_DIR": root / "clean",
+        "STEGO_DIR": root / "stego",
+        "OUTPUT_CSV": out / "analysis_results.csv",
+        "RESULTS_NPY": out / "analysis_results.npy",
+        "RAW_CSV": out / "raw_features.csv",
+        "ROC_CSV": out / "roc_sweep.csv",
+        "ROC_AUC_JSON": out / "roc_auc.json",
+        "CACHE_DB": out / "feature_cache.sqlite",
+        "MANIFEST_DB": out / "corpus_manifest.sqlite",
+    }
+    saved = {name: getattr(run_analysis, name) for name in redirect}
+    saved_profile = detect_lsb.BASELINE_PROFILE
+    for name, value in redirect.items():
+        setattr(run_analysis, name, value)
+    detect_lsb.BASELINE_PROFILE = out / "baseline_profile.json"
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(run_analysis, name, value)
+        detect_lsb.BASELINE_PROFILE = saved_profile
+
+
+def bench_pipeline(root, n_images, repeat=1):
+    """Time run_analysis.main (serial, no feature cache) over the synthetic corpus."""
+    samples = []
+    reset_peak_rss()
+    with pipeline_in(root):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_analysis.main(workers=1, use_cache=False)
+            samples.append(time.perf_counter() - start)
+    stats = summarize(samples, n_images * len(samples))
+    stats["peak_rss_mb"] = peak_rss_mb()
+    stats["n_images"] = n_images
+    return stats
+
+
+def run_benchmarks(sizes, per_size=IMAGES_PER_SIZE, repeat=REPEAT):
+    with tempfile.TemporaryDirectory(prefix="bench_lsb_") as tmp:
+        corpus = build_corpus(tmp, sizes, per_size)
+
+        # Baseline profile for suspicious_score, from the synthetic clean images
+        clean = [analyze_image(p) for images in corpus.values() for p, label in images if label == "clean"]
+        profile = build_baseline_profile(clean, max_raw_score=1.0, source="synthetic")
+
+        stages = {}
+        for name, images in corpus.items():
+            for stage, stats in bench_detectors(images, profile, repeat).items():
+                stages[f"{name}/{stage}"] = stats
+
+        n_images = sum(len(images) for images in corpus.values())
+        stages["pipeline/run_analysis.main"] = bench_pipeline(tmp, n_images)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "sizes": {name: SIZES[name] for name in sizes},
+            "images_per_size": per_size * (1 + len(PAYLOAD_RATIOS)),
+            "repeat": repeat,
+            "per_stage_rss": reset_peak_rss(),
+        },
+        "stages": stages,
+    }
+
+
+# -------------------------------
+# Reporting / Baseline Comparison
+# -------------------------------
+def print_results(results):
+    print(f"{'stage':34s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} {'img/s':>9s} {'peak MB':>8s}")
+    for stage, s in results["stages"].items():
+        print(
+            f"{stage:34s} {s['p50_ms']:9.3f} {s['p90_ms']:9.3f} {s['p99_ms']:9.3f} "
+            f"{s['images_per_s']:9.1f} {s['peak_rss_mb']:8.1f}"
+        )
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Median latency of every stage against a stored baseline. Returns the
+    (stage, baseline ms, current ms) of stages that got slower by more
+    than `threshold` (a share, 0.25 = 25%) and by REGRESSION_MIN_MS.
+    """
+    regressions = []
+    print(f"\n=== Against baseline (threshold +{threshold:.0%}) ===")
+    for stage, s in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old is None:
+            print(f"{stage:34s} (new stage)")
+            continue
+        change = s["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] > 0 else 0.0
+        slower = change > threshold and s["p50_ms"] - old["p50_ms"] >= REGRESSION_MIN_MS
+        flag = "REGRESSION" if slower else ""
+        print(f"{stage:34s} {old['p50_ms']:9.3f} -> {s['p50_ms']:9.3f} ms ({change:+7.1%}) {flag}")
+        if slower:
+            regressions.append((stage, old["p50_ms"], s["p50_ms"]))
+    return regressions
+
+
+def main(sizes=tuple(SIZES), per_size=IMAGES_PER_SIZE, repeat=REPEAT, output=BENCH_JSON,
+         baseline=BENCH_BASELINE, save_baseline=False, threshold=REGRESSION_THRESHOLD):
+    results = run_benchmarks(sizes, per_size, repeat)
+    print_results(results)
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("\nResults written →", output)
+
+    baseline = Path(baseline)
+    if save_baseline:
+        with open(baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Baseline saved →", baseline)
+        return 0
+
+    if not baseline.exists():
+        print(f"No baseline at {baseline}; run with --save-baseline to store one")
+        return 0
+
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), threshold)
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) slower than the baseline by more than {threshold:.0%}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the LSB detectors and the analysis pipeline.")
+    parser.add_argument(
+        "--sizes", nargs="+", choices=list(SIZES), default=list(SIZES),
+        help="synthetic image sizes to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--images", type=int, default=IMAGES_PER_SIZE,
+        help=f"clean images per size, each with {len(PAYLOAD_RATIOS)} stego variants (default: {IMAGES_PER_SIZE})",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=REPEAT,
+        help=f"passes over the images per stage (default: {REPEAT})",
+    )
+    parser.add_argument(
+        "--output", type=Path, default=BENCH_JSON,
+        help="where to write the JSON results",
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=BENCH_BASELINE,
+        help="stored results to compare against",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="store this run as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=REGRESSION_THRESHOLD,
+        help="allowed growth of a stage's median latency, as a share (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(
+        sizes=args.sizes,
+        per_size=args.images,
+        repeat=args.repeat,
+        output=args.output,
+        baseline=args.baseline,
+        save_baseline=args.save_baseline,
+        threshold=args.threshold,
+    ))
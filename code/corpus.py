@@ -0,0 +1,265 @@
+import json
+import os
+import sqlite3
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from detect_lsb import JPEG_MAGIC, NPY_MAGIC
+from feature_cache import file_sha256
+
+# Leading bytes that identify each image format we can decode
+IMAGE_MAGICS = {
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpeg": (JPEG_MAGIC,),
+    "bmp": (b"BM",),
+    "tiff": (b"II*\x00", b"MM\x00*"),
+    "npy": (NPY_MAGIC,),
+}
+
+# Bytes read from the start of a file to sniff its format and size
+SNIFF_BYTES = 32
+
+# .npy header parsers by format version
+NPY_HEADER_READERS = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0,
+}
+
+# JPEG start-of-frame markers (the ones carrying the image dimensions)
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+# -------------------------------
+# Format sniffing
+# -------------------------------
+def _sniff_format(head):
+    for fmt, magics in IMAGE_MAGICS.items():
+        if any(head.startswith(m) for m in magics):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _jpeg_size(f):
+    # Walk the marker segments up to the first start-of-frame
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] in (0x01, 0xFF) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if marker[1] in JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+def sniff_image(path):
+    """
+    Identify an image file by its magic bytes, whatever its extension.
+    Returns (format, width, height), with width/height None when the
+    header does not give them cheaply, or None for non-image files.
+    """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+        fmt = _sniff_format(head)
+        size = None
+
+        if fmt == "png" and head[12:16] == b"IHDR":
+            size = struct.unpack(">II", head[16:24])
+        elif fmt == "bmp" and len(head) >= 26:
+            width, height = struct.unpack("<ii", head[18:26])
+            size = (width, abs(height))
+        elif fmt == "jpeg":
+            size = _jpeg_size(f)
+        elif fmt == "npy":
+            f.seek(0)
+            read_header = NPY_HEADER_READERS.get(np.lib.format.read_magic(f))
+            shape = read_header(f)[0] if read_header is not None else ()
+            if len(shape) >= 2:
+                size = (shape[1], shape[0])
+
+    if fmt is None:
+        return None
+    width, height = size if size is not None else (None, None)
+    return fmt, width, height
+
+
+# -------------------------------
+# Manifest
+# -------------------------------
+class CorpusManifest:
+    """
+    On-disk (SQLite) index of every file under the corpus roots: path,
+    size, mtime, content hash, sniffed format, dimensions and label.
+
+    Rescans are incremental. A directory whose mtime is unchanged has the
+    same entries as last time, so its files are not listed or stat'ed
+    again and only its subdirectories are visited. Files in changed
+    directories are stat'ed, and only new or modified ones are re-sniffed
+    and re-hashed. Editing a file in place does not touch its directory's
+    mtime, so pass full=True to scan() to stat every file.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path     TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                subdirs  TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path     TEXT PRIMARY KEY,
+                dir      TEXT NOT NULL,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256   TEXT,
+                format   TEXT,
+                width    INTEGER,
+                height   INTEGER,
+                label    TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        """)
+        self.stats = {"dirs_listed": 0, "dirs_skipped": 0, "files_indexed": 0}
+
+    def scan(self, roots, full=False):
+        """
+        Bring the manifest up to date for a list of (directory, label)
+        roots; every file below a root gets that root's label.
+        """
+        self.stats = dict.fromkeys(self.stats, 0)
+        for root, label in roots:
+            root = Path(root).resolve()
+            if root.is_dir():
+                self._scan_dir(str(root), label, full)
+            else:
+                self._forget_dir(str(root))
+        self.conn.commit()
+        return self.stats
+
+    def _scan_dir(self, path, label, full):
+        mtime_ns = os.stat(path).st_mtime_ns
+        row = self.conn.execute(
+            "SELECT mtime_ns, subdirs FROM dirs WHERE path = ?", (path,)
+        ).fetchone()
+
+        if row is not None and row[0] == mtime_ns and not full:
+            subdirs = json.loads(row[1])
+            self.conn.execute("UPDATE files SET label = ? WHERE dir = ?", (label, path))
+            self.stats["dirs_skipped"] += 1
+        else:
+            subdirs = self._list_dir(path, label, mtime_ns)
+            self.stats["dirs_listed"] += 1
+
+        for sub in subdirs:
+            self._scan_dir(sub, label, full)
+
+    def _list_dir(self, path, label, mtime_ns):
+        known = {
+            r[0]: r[1:]
+            for r in self.conn.execute(
+                "SELECT path, size, mtime_ns FROM files WHERE dir = ?", (path,)
+            )
+        }
+        old_subdirs = self.conn.execute(
+            "SELECT subdirs FROM dirs WHERE path = ?", (path,)
+        ).fetchone()
+
+        subdirs = []
+        seen = set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+
+                st = entry.stat()
+                seen.add(entry.path)
+                if known.get(entry.path) == (st.st_size, st.st_mtime_ns):
+                    self.conn.execute(
+                        "UPDATE files SET label = ? WHERE path = ?", (label, entry.path)
+                    )
+                    continue
+
+                info = sniff_image(entry.path)
+                fmt, width, height = info if info is not None else (None, None, None)
+                digest = file_sha256(entry.path) if fmt is not None else None
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files"
+                    " (path, dir, size, mtime_ns, sha256, format, width, height, label)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry.path, path, st.st_size, st.st_mtime_ns, digest, fmt, width, height, label),
+                )
+                self.stats["files_indexed"] += 1
+
+        for gone in known.keys() - seen:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (gone,))
+
+        subdirs.sort()
+        if old_subdirs is not None:
+            for gone in set(json.loads(old_subdirs[0])) - set(subdirs):
+                self._forget_dir(gone)
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+            # mtime from before the listing, so a change made meanwhile
+            # is picked up by the next scan
+            (path, mtime_ns, json.dumps(subdirs)),
+        )
+        return subdirs
+
+    def _forget_dir(self, path):
+        prefix = path.rstrip(os.sep) + os.sep
+        self.conn.execute(
+            "DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?",
+            (path, len(prefix), prefix),
+        )
+        self.conn.execute(
+            "DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+            (path, len(prefix), prefix),
+        )
+
+    def images(self, roots):
+        """
+        Manifest rows (as dicts) of the image files under the given
+        (directory, label) roots, root by root and sorted by path.
+        """
+        columns = ["path", "size", "mtime_ns", "sha256", "format", "width", "height", "label"]
+        out = []
+        for root, _ in roots:
+            root = str(Path(root).resolve())
+            prefix = root + os.sep
+            rows = self.conn.execute(
+                f"SELECT {', '.join(columns)} FROM files"
+                " WHERE format IS NOT NULL AND (dir = ? OR substr(dir, 1, ?) = ?)"
+                " ORDER BY path",
+                (root, len(prefix), prefix),
+            )
+            out.extend(dict(zip(columns, r)) for r in rows)
+        return out
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
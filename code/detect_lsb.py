@@ -1,27 +1,123 @@
+import io
+import json
+from functools import lru_cache
+from pathlib import Path
+
 import cv2
 import numpy as np
-from scipy.stats import chisquare
+from scipy.stats import chi2
+
+from jpeg_dct import read_dct_coefficients
+from png_rows import PNG_MAGIC, read_png_rows
+from profiling import stage, timed
 
 # Limit number of bits analyzed per image for speed
 MAX_BITS = 10_000
 
+# triage_report: images whose quick suspicious_score stays below this
+# are called clean without a full analysis
+TRIAGE_THRESHOLD = 0.1
+
+# Bump whenever a detector's output changes so cached features are recomputed
+DETECTOR_VERSION = 6
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
 # -------------------------------
-# LSB Extraction
+# Image Loading
 # -------------------------------
-def extract_lsb(image_path):
-    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+# Magic prefix of .npy files (raw arrays written by generate_stego_png --format npy)
+NPY_MAGIC = b"\x93NUMPY"
+
+# Magic prefix of JPEG files (SOI marker plus the start of the next marker)
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+def _as_channels(arr):
+    # .npy stego images keep their original layout; give 2-D ones a channel axis
+    return arr[:, :, None] if arr.ndim == 2 else arr
+
+
+def _as_color(arr):
+    """
+    The 8-bit BGR view cv2.IMREAD_COLOR gives of the same pixels stored as
+    a PNG: 16-bit samples keep their high byte, gray is repeated into
+    three channels and alpha is dropped. 8-bit BGR arrays (e.g. a
+    memory-mapped .npy) are returned as they are.
+    """
+    arr = _as_channels(arr)
+    if arr.dtype == np.uint16:
+        arr = (arr >> 8).astype(np.uint8)
+    if arr.shape[2] <= 2:
+        arr = np.repeat(arr[:, :, :1], 3, axis=2)
+    elif arr.shape[2] == 4:
+        arr = arr[:, :, :3]
+    return arr
+
+
+def load_image(image, unchanged=False):
+    """
+    Decode an image once so every detector can share the same pixels.
+    Accepts a file path, raw encoded bytes (e.g. an upload) or an
+    already-decoded NumPy array, and returns a BGR uint8 array.
+    With unchanged=True the stored channels are kept instead (grayscale,
+    alpha, 16-bit), always with a channel axis. .npy files and arrays
+    are converted to the same BGR uint8 view (see _as_color), so a stego
+    image gives the same features in any container.
+    .npy files are memory-mapped rather than read, so strip-wise analysis
+    (analyze_image) only pages in the rows it touches.
+    """
+    if isinstance(image, np.ndarray):
+        return _as_channels(image) if unchanged else _as_color(image)
+
+    with stage("imread") as timed_read:
+        img = _read_image(image, unchanged)
+        timed_read.nbytes = img.nbytes
+    return img
+
+
+def _read_image(image, unchanged):
+    flags = cv2.IMREAD_UNCHANGED if unchanged else cv2.IMREAD_COLOR
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        if bytes(image[:len(NPY_MAGIC)]) == NPY_MAGIC:
+            arr = np.load(io.BytesIO(image))
+            return _as_channels(arr) if unchanged else _as_color(arr)
+        buf = np.frombuffer(image, dtype=np.uint8)
+        img = cv2.imdecode(buf, flags)
+        if img is None:
+            raise ValueError("Could not decode image bytes")
+        return _as_channels(img)
+
+    # Recognize .npy containers by content, whatever the file is called
+    with open(image, "rb") as f:
+        is_npy = f.read(len(NPY_MAGIC)) == NPY_MAGIC
+    if is_npy:
+        arr = np.load(image, mmap_mode="r")
+        return _as_channels(arr) if unchanged else _as_color(arr)
+
+    img = cv2.imread(str(image), flags)
     if img is None:
-        raise ValueError("Could not read image: " + image_path)
+        raise ValueError("Could not read image: " + str(image))
+    return _as_channels(img)
 
-    # Extract blue channel
-    blue = img[:, :, 0].flatten()
 
-    # Extract LSBs
-    lsbs = blue & 1
+# -------------------------------
+# LSB Extraction
+# -------------------------------
+def extract_lsb(image):
+    img = load_image(image)
+
+    with stage("lsb_extract", img.nbytes):
+        # Extract blue channel
+        blue = img[:, :, 0].flatten()
+
+        # Extract LSBs
+        lsbs = blue & 1
 
-    # Limit size for performance
-    if lsbs.size > MAX_BITS:
-        lsbs = lsbs[:MAX_BITS]
+        # Limit size for performance
+        if lsbs.size > MAX_BITS:
+            lsbs = lsbs[:MAX_BITS]
 
     return lsbs
 
@@ -29,47 +125,41 @@ def extract_lsb(image_path):
 # -------------------------------
 # Chi-Square Test
 # -------------------------------
+def _chi_square_from_ones(ones, block_size):
+    """
+    Chi-square against a 50/50 LSB split for many blocks at once, given
+    the number of 1 bits in each block of `block_size` bits.
+    Returns per-block chi values, p-values and LSB bias.
+    """
+    zeros = block_size - ones
+
+    # Same statistic scipy.stats.chisquare computes for two equal bins
+    expected = block_size * 0.5
+    chi_values = ((zeros - expected) ** 2 + (ones - expected) ** 2) / expected
+    p_values = chi2.sf(chi_values, df=1)
+    bias_values = np.abs(ones / block_size - 0.5)
+
+    return chi_values, p_values, bias_values
+
+
+@timed("chi_square")
 def chi_square_test(lsb_array, block_size=32):
+    lsb_array = np.asarray(lsb_array)
     n = len(lsb_array)
     if n == 0:
         return 0.0, 0.0, 0.0, 0.0  # mean_chi, std_chi, frac_sig, mean_bias
 
     if n < block_size:
-        counts = np.bincount(lsb_array, minlength=2)
-        total = counts.sum()
-        expected = [total * 0.5, total * 0.5]
-        chi, p = chisquare(counts, f_exp=expected)
-
-        # bias for this tiny block
-        prop_1 = counts[1] / total if total > 0 else 0.0
-        bias = abs(prop_1 - 0.5)
-
+        # Treat the whole (tiny) array as a single block
+        chi, p, bias = _chi_square_from_ones(lsb_array.sum(dtype=np.int64), n)
         frac_sig = 1.0 if p < 0.05 else 0.0
         return float(chi), 0.0, float(frac_sig), float(bias)
 
     n_blocks = n // block_size
     trimmed = lsb_array[:n_blocks * block_size].reshape(n_blocks, block_size)
 
-    chi_values = []
-    p_values = []
-    bias_values = []
-
-    for block in trimmed:
-        counts = np.bincount(block, minlength=2)
-        total = counts.sum()
-        expected = [total * 0.5, total * 0.5]
-        chi, p = chisquare(counts, f_exp=expected)
-
-        chi_values.append(chi)
-        p_values.append(p)
-
-        # LSB bias for this block
-        prop_1 = counts[1] / total if total > 0 else 0.0
-        bias_values.append(abs(prop_1 - 0.5))
-
-    chi_values = np.array(chi_values)
-    p_values = np.array(p_values)
-    bias_values = np.array(bias_values)
+    ones = trimmed.sum(axis=1, dtype=np.int64)
+    chi_values, p_values, bias_values = _chi_square_from_ones(ones, block_size)
 
     mean_chi = float(chi_values.mean())
     std_chi = float(chi_values.std())
@@ -77,81 +167,155 @@ def chi_square_test(lsb_array, block_size=32):
     mean_bias = float(bias_values.mean())
 
     return mean_chi, std_chi, frac_sig, mean_bias
+
 # -------------------------------
 # RS Analysis
 # -------------------------------
-import cv2
-import numpy as np
 
-MAX_BITS = 10_000
-# assumes MAX_BITS is already defined above in your file
+# Multiple flip masks: which pixels in the group to flip
+# 1 = flip that pixel's LSB, 0 = leave it
+RS_MASKS = np.array([
+    [1, 0, 0, 0],
+    [0, 1, 0, 0],
+    [0, 0, 1, 0],
+    [0, 0, 0, 1],
+    [1, 1, 0, 0],
+    [0, 1, 1, 0],
+    [0, 0, 1, 1],
+    [1, 0, 1, 0],
+], dtype=np.int16)
+
+# Groups handled per chunk; bounds the temporaries for large images
+RS_CHUNK_GROUPS = 1 << 18
+
 
-def rs_analysis(image_path, group_size=4):
+def _rs_pattern_count(group_size):
+    # Neighbor differences clipped to [-2, 2] (5 values) times LSB bits
+    return 5 ** (group_size - 1) * 2 ** group_size
+
+
+def rs_histogram(pixels, group_size=4):
     """
-    RS analysis with multiple flip masks on 4-pixel groups.
-    Returns a single scalar: mean normalized RS score across masks.
+    Histogram of group patterns used by RS analysis.
+    A flip changes a pixel by at most 1, so whether a group becomes more
+    or less "noisy" only depends on its neighbor differences clipped to
+    [-2, 2] and on its LSBs. Each group is reduced to that pattern and
+    counted once; histograms of separate pixel runs can simply be added.
+    `pixels` may also be 2-D (pixels x columns, e.g. one column per
+    channel); the result then has one histogram row per column.
     """
-    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
-    if img is None:
-        raise ValueError("Could not read: " + image_path)
+    columns = pixels if pixels.ndim == 2 else pixels[:, None]
+    n_cols = columns.shape[1]
 
-    # Use blue channel, same as your other code
-    blue = img[:, :, 0].astype(np.int16)
-    flat = blue.flatten()
+    n_patterns = _rs_pattern_count(group_size)
+    hist = np.zeros(n_cols * n_patterns, dtype=np.int64)
 
-    # Limit to a fixed number of bits/groups for consistency
-    max_groups = MAX_BITS // group_size
-    if flat.size > max_groups * group_size:
-        flat = flat[:max_groups * group_size]
+    code_type = np.min_scalar_type(n_cols * n_patterns - 1)
+    diff_weights = (5 ** np.arange(group_size - 1) * 2 ** group_size).astype(code_type)
+    lsb_weights = (2 ** np.arange(group_size)).astype(code_type)
+    # Each column counts into its own block of patterns
+    col_offsets = (np.arange(n_cols) * n_patterns).astype(code_type)
+    diff_type = np.int16 if columns.dtype.itemsize == 1 else np.int32
 
-    n = len(flat) // group_size
-    if n == 0:
-        return 0.0
+    n = len(columns) // group_size
+    for start in range(0, n, RS_CHUNK_GROUPS):
+        stop = min(start + RS_CHUNK_GROUPS, n)
+        chunk = columns[start * group_size:stop * group_size]
+        groups = chunk.reshape(-1, group_size, n_cols).transpose(0, 2, 1)
+
+        diffs = np.diff(groups.astype(diff_type), axis=2)
+        np.clip(diffs, -2, 2, out=diffs)
+        diffs += 2
+
+        codes = diffs.astype(code_type) @ diff_weights
+        codes += (groups & 1).astype(code_type) @ lsb_weights
+        codes += col_offsets
+        hist += np.bincount(codes.ravel(), minlength=n_cols * n_patterns)
 
-    groups = flat[:n * group_size].reshape(-1, group_size)
+    hist = hist.reshape(n_cols, n_patterns)
+    return hist if pixels.ndim == 2 else hist[0]
+
+
+def _rs_pattern_signs(group_size, masks, flip):
+    """
+    For every (mask, pattern) pair: +1 if flipping makes the group more
+    noisy (regular), -1 if less (singular), 0 if unchanged.
+    """
+    patterns = np.arange(_rs_pattern_count(group_size))
+    lsbs = (patterns[:, None] >> np.arange(group_size)) & 1
+    diffs = (patterns[:, None] >> group_size) // 5 ** np.arange(group_size - 1) % 5 - 2
+
+    # F1 moves even values up and odd values down, F-1 the opposite
+    step = (1 - 2 * lsbs) * flip
 
     # Discrimination function: sum of absolute differences between neighbors
-    def discr(g):
-        return np.sum(np.abs(np.diff(g)))
+    flipped_diffs = diffs + np.diff(masks[:, None, :] * step, axis=2)
+    change = (np.abs(flipped_diffs) - np.abs(diffs)).sum(axis=2)
+    return np.sign(change)
+
+
+def rs_counts_from_histogram(hist, group_size=4, masks=RS_MASKS, flip=1):
+    """
+    Regular/singular counts for every mask from an rs_histogram.
+    flip=1 applies the LSB flip F1 (0<->1, 2<->3, ...), flip=-1 the
+    shifted flip F-1 (-1<->0, 1<->2, ...).
+    Returns (R, S) as int64 arrays with one entry per mask; for a 2-D
+    (columns, patterns) histogram, (masks, columns) arrays.
+    """
+    masks = np.asarray(masks, dtype=np.int16)[:, :group_size]
+    if masks.shape[1] != group_size:
+        raise ValueError(f"Masks must cover {group_size} pixels per group")
+
+    signs = _rs_pattern_signs(group_size, masks, flip)  # (masks, patterns)
+
+    R = (signs > 0).astype(np.int64) @ hist.T  # regular groups
+    S = (signs < 0).astype(np.int64) @ hist.T  # singular groups
+    return R, S
 
-    orig_D = np.apply_along_axis(discr, 1, groups)
 
-    # Multiple flip masks: which pixels in the group to flip
-    # 1 = flip that pixel's LSB, 0 = leave it
-    masks = np.array([
-        [1, 0, 0, 0],
-        [0, 1, 0, 0],
-        [0, 0, 1, 0],
-        [0, 0, 0, 1],
-        [1, 1, 0, 0],
-        [0, 1, 1, 0],
-        [0, 0, 1, 1],
-        [1, 0, 1, 0],
-    ], dtype=np.int8)
+@timed("rs_analysis")
+def rs_counts(pixels, group_size=4, masks=RS_MASKS, flip=1):
+    """
+    Count regular and singular groups for every mask at once.
+    `pixels` is a 1-D array of pixel values split into groups of `group_size`.
+    """
+    hist = rs_histogram(pixels, group_size)
+    return rs_counts_from_histogram(hist, group_size, masks, flip)
 
-    rs_values = []
 
-    for mask in masks:
-        flipped = groups.copy()
+def rs_analysis(image, group_size=4, flip=1, full_image=False):
+    """
+    RS analysis with multiple flip masks on 4-pixel groups.
+    `image` may be a path, encoded bytes or a decoded array (see load_image).
+    By default only the first MAX_BITS pixels are used; full_image=True
+    analyzes every pixel. flip=-1 uses the negative (F-1) masks.
+    Returns the mean and std of the normalized RS score across masks.
+    """
+    img = load_image(image)
 
-        # Flip LSBs according to the mask
-        for i in range(group_size):
-            if mask[i]:
-                flipped[:, i] ^= 1
+    # Use blue channel, same as your other code
+    blue = img[:, :, 0]
 
-        flipped_D = np.apply_along_axis(discr, 1, flipped)
+    if full_image:
+        flat = blue.ravel()
+    else:
+        # Limit to a fixed number of bits/groups for consistency
+        max_groups = MAX_BITS // group_size
+        limit = max_groups * group_size
+        rows = -(-limit // blue.shape[1])  # only copy the rows we need
+        flat = blue[:rows].ravel()[:limit]
 
-        R = np.sum(flipped_D > orig_D)  # regular groups
-        S = np.sum(flipped_D < orig_D)  # singular groups
+    if len(flat) // group_size == 0:
+        return 0.0, 0.0
 
-        if R + S == 0:
-            rs_norm = 0.0
-        else:
-            rs_norm = (R - S) / (R + S)
+    R, S = rs_counts(flat, group_size, flip=flip)
+    return _rs_scores(R, S)
 
-        rs_values.append(rs_norm)
 
-    rs_values = np.array(rs_values, dtype=np.float64)
+def _rs_scores(R, S):
+    # Normalized RS score per mask, summarized as mean and std
+    total = R + S
+    rs_values = np.where(total > 0, (R - S) / np.maximum(total, 1), 0.0)
 
     # You can also return rs_values.std() if you want a second feature
     RS_mean = float(rs_values.mean())
@@ -161,6 +325,7 @@ def rs_analysis(image_path, group_size=4):
 # -------------------------------
 # Sample Pair Analysis
 # -------------------------------
+@timed("sample_pair")
 def sample_pair_stat(lsb_array):
     if len(lsb_array) < 2:
         return None, None
@@ -176,28 +341,757 @@ def sample_pair_stat(lsb_array):
 
     return float(pair_equal_ratio), float(deviation_from_half)
 
+
+def _trace_counts(u, v):
+    # Sizes of the SPA trace sets over pixel pairs (u, v), as
+    # [X, Y, W + Z, all pairs]:
+    #   X: v even and u < v, or v odd and u > v
+    #   Y: v even and u > v, or v odd and u < v
+    #   W + Z: u and v differ at most in the LSB
+    odd = (v & 1).astype(bool)
+    lt = u < v
+    gt = u > v
+    return np.array([
+        np.count_nonzero(lt & ~odd) + np.count_nonzero(gt & odd),
+        np.count_nonzero(gt & ~odd) + np.count_nonzero(lt & odd),
+        np.count_nonzero((u >> 1) == (v >> 1)),
+        u.size,
+    ], dtype=np.int64)
+
+
+def spa_counts(channel):
+    """
+    SPA trace-set counts (see _trace_counts) over every horizontally and
+    vertically adjacent pixel pair of a 2-D channel, computed in row
+    strips of about STRIP_PIXELS pixels. Counts are additive, so those
+    of several images or tiles can be summed.
+    """
+    h, w = channel.shape
+    rows_per_strip = max(1, STRIP_PIXELS // w)
+    counts = np.zeros(4, dtype=np.int64)
+    last_row = None
+
+    for top in range(0, h, rows_per_strip):
+        strip = np.ascontiguousarray(channel[top:top + rows_per_strip])
+        counts += _trace_counts(strip[:, :-1], strip[:, 1:])
+        counts += _trace_counts(strip[:-1], strip[1:])
+        # Vertical pairs across the strip boundary
+        if last_row is not None:
+            counts += _trace_counts(last_row, strip[0])
+        last_row = strip[-1]
+
+    return counts
+
+
+def spa_estimate(counts):
+    """
+    Dumitrescu-Wu-Wang sample pair estimate of the LSB embedding rate
+    (fraction of pixels carrying message bits) from SPA trace-set counts:
+    the smaller root p of
+        (|W| + |Z|) / 2 * p^2 + (2|X| - |P|) * p + |Y| - |X| = 0,
+    clipped to [0, 1]. None when there are no usable pairs.
+    """
+    x, y, wz, n = (int(c) for c in counts)
+    if n == 0 or wz == 0:
+        return None
+
+    a = 0.5 * wz
+    b = 2 * x - n
+    c = y - x
+    # A negative discriminant (noisy counts on tiny images) means no
+    # real root; fall back to the vertex of the parabola
+    root = np.sqrt(max(b * b - 4 * a * c, 0.0))
+    p = (-b - root) / (2 * a)
+    return float(min(max(p, 0.0), 1.0))
+
+
+@timed("spa")
+def spa_rate(channel):
+    """Estimated LSB embedding rate of a 2-D channel, using all its pixels."""
+    return spa_estimate(spa_counts(channel))
+
 # -------------------------------
-# Suspicious Score Calculation
+# Full-Image (Tiled) Analysis
+# -------------------------------
+
+# Ways to choose which blue-channel pixels are analyzed:
+#   prefix - the first max_bits pixels in raster order (extract_lsb behavior)
+#   stride - max_bits pixels spread evenly over the whole image
+#   random - max_bits pixels from random places in the image
+#   full   - every pixel
+BIT_BUDGETS = ("prefix", "stride", "random", "full")
+
+# Pixels per row strip; bounds working memory regardless of image size
+STRIP_PIXELS = 1 << 20
+
+
+def _iter_strips(channel, budget, max_bits, run_length, seed):
+    """
+    Yield the selected pixels of a 2-D channel strip by strip, in raster order.
+    A 3-D (h, w, c) array yields (pixels, c) strips, so several channels
+    are read together.
+    Sampled budgets pick whole runs of `run_length` neighboring pixels so
+    chi-square blocks, RS groups and sample pairs still see adjacent pixels.
+    """
+    h, w = channel.shape[:2]
+    total = h * w
+    rows_per_strip = max(1, STRIP_PIXELS // w)
+    pixel_shape = (-1, *channel.shape[2:])
+
+    if budget == "full" or (budget != "prefix" and max_bits >= total):
+        for top in range(0, h, rows_per_strip):
+            yield channel[top:top + rows_per_strip].reshape(pixel_shape)
+        return
+
+    if budget == "prefix":
+        remaining = max_bits
+        for top in range(0, h, rows_per_strip):
+            if remaining <= 0:
+                return
+            strip = channel[top:top + rows_per_strip].reshape(pixel_shape)[:remaining]
+            remaining -= len(strip)
+            yield strip
+        return
+
+    n_runs = total // run_length
+    wanted = max(1, min(n_runs, max_bits // run_length))
+    if budget == "stride":
+        runs = np.linspace(0, n_runs, wanted, endpoint=False).astype(np.int64)
+    elif budget == "random":
+        rng = np.random.default_rng(seed)
+        runs = np.sort(rng.choice(n_runs, size=wanted, replace=False))
+    else:
+        raise ValueError(f"Unknown bit budget {budget!r}, expected one of {BIT_BUDGETS}")
+
+    starts = runs * run_length
+    offsets = np.arange(run_length)
+    for top in range(0, h, rows_per_strip):
+        strip = channel[top:top + rows_per_strip].reshape(pixel_shape)
+        lo = top * w
+        # Every run overlapping the strip, including one that started in
+        # the previous strip (when w is not a multiple of run_length): each
+        # strip yields its part of the run, so the stream holds whole runs
+        # in order, exactly as gathering them from the flat channel would
+        first = np.searchsorted(starts, lo - run_length, side="right")
+        last = np.searchsorted(starts, lo + len(strip))
+        if first == last:
+            continue
+        idx = (starts[first:last, None] - lo + offsets).ravel()
+        yield strip[idx[(idx >= 0) & (idx < len(strip))]]
+
+
+def _strip_unit(block_size, group_size):
+    # Sampled runs cover whole chi-square blocks, RS groups and pairs
+    return int(np.lcm.reduce([block_size, group_size, 2]))
+
+
+def _column_features(strips, n_cols, block_size, group_size):
+    """
+    Chi-square, RS and sample-pair features of every column of a stream
+    of (pixels, n_cols) strips, in one pass. Columns are independent
+    signals (e.g. channels or bit-planes); returns one dict per column.
+    """
+    # Every statistic here is additive, so each strip only updates counts:
+    #   chi-square: histogram of the number of 1 bits per block
+    #   RS: histogram of group patterns (see rs_histogram)
+    #   sample pair: equal / total LSB pairs
+    ones_hist = np.zeros((n_cols, block_size + 1), dtype=np.int64)
+    rs_hist = np.zeros((n_cols, _rs_pattern_count(group_size)), dtype=np.int64)
+    equal_pairs = np.zeros(n_cols, dtype=np.int64)
+    total_pairs = 0
+
+    # Each column counts into its own block of the chi-square histogram
+    col_offsets = np.arange(n_cols) * (block_size + 1)
+    count_type = np.uint8 if block_size < 256 else np.int64
+
+    # Pixels left over from one strip are carried into the next so blocks,
+    # groups and pairs line up exactly as they would on the flat array
+    unit = _strip_unit(block_size, group_size)
+    carry = None
+    n_pixels = 0
+
+    for pixels in strips:
+        n_pixels += len(pixels)
+        if carry is not None and len(carry):
+            pixels = np.concatenate([carry, pixels])
+        usable = len(pixels) // unit * unit
+        pixels, carry = pixels[:usable], pixels[usable:]
+        if not usable:
+            continue
+
+        # One contiguous row of LSBs per column: sums along the last axis
+        # stay fast whatever the number of columns
+        with stage("lsb_extract", pixels.nbytes):
+            lsbs = np.ascontiguousarray((pixels & 1).T)
+
+        with stage("chi_square", pixels.nbytes):
+            ones = lsbs.reshape(n_cols, -1, block_size).sum(axis=2, dtype=count_type)
+            ones_hist += np.bincount(
+                (ones + col_offsets[:, None]).ravel(), minlength=n_cols * (block_size + 1)
+            ).reshape(n_cols, block_size + 1)
+
+        with stage("rs_analysis", pixels.nbytes):
+            rs_hist += rs_histogram(pixels, group_size)
+
+        with stage("sample_pair", pixels.nbytes):
+            pairs = lsbs.reshape(n_cols, -1, 2)
+            equal_pairs += np.count_nonzero(pairs[:, :, 0] == pairs[:, :, 1], axis=1)
+            total_pairs += pairs.shape[1]
+
+    # Tail shorter than one unit: no full chi-square block, but it can
+    # still hold whole RS groups and sample pairs
+    if carry is not None and len(carry):
+        with stage("rs_analysis", carry.nbytes):
+            rs_hist += rs_histogram(carry, group_size)
+        with stage("sample_pair", carry.nbytes):
+            tail_pairs = (carry[:len(carry) // 2 * 2] & 1).reshape(-1, 2, n_cols)
+            equal_pairs += np.count_nonzero(tail_pairs[:, 0] == tail_pairs[:, 1], axis=0)
+            total_pairs += tail_pairs.shape[0]
+
+    chi_values, p_values, bias_values = _chi_square_from_ones(
+        np.arange(block_size + 1), block_size
+    )
+    with stage("rs_analysis"):
+        R, S = rs_counts_from_histogram(rs_hist, group_size)  # (masks, columns)
+
+    results = []
+    for col in range(n_cols):
+        # --- chi-square ---
+        hist = ones_hist[col]
+        if hist.sum() == 0:
+            tail = carry[:, col] & 1 if carry is not None else np.empty(0, dtype=np.uint8)
+            chi_mean, chi_std, chi_frac, chi_bias = chi_square_test(tail, block_size)
+        else:
+            chi_mean = float(np.average(chi_values, weights=hist))
+            chi_std = float(np.sqrt(np.average((chi_values - chi_mean) ** 2, weights=hist)))
+            chi_frac = float(hist[p_values < 0.05].sum() / hist.sum())
+            chi_bias = float(np.average(bias_values, weights=hist))
+
+        # --- RS ---
+        if n_pixels // group_size == 0:
+            RS_mean, RS_std = 0.0, 0.0
+        else:
+            RS_mean, RS_std = _rs_scores(R[:, col], S[:, col])
+
+        # --- sample pair ---
+        if total_pairs == 0:
+            sp_ratio, sp_dev = None, None
+        else:
+            sp_ratio = int(equal_pairs[col]) / total_pairs
+            sp_dev = abs(sp_ratio - 0.5)
+
+        results.append({
+            "chi_mean": chi_mean,
+            "chi_std": chi_std,
+            "chi_frac_p_lt_0_05": chi_frac,
+            "chi_bias": chi_bias,
+            "RS_mean": RS_mean,
+            "RS_std": RS_std,
+            "SP_equal_ratio": sp_ratio,
+            "SP_dev_from_0_5": sp_dev,
+            # Pairs of values is only run on JPEG coefficients (analyze_jpeg)
+            "pov_chi": None,
+            "pov_p": None,
+        })
+
+    return results
+
+
+def analyze_image(image, budget="prefix", max_bits=MAX_BITS,
+                  block_size=32, group_size=4, seed=0):
+    """
+    Chi-square, RS and sample-pair features for one image, computed strip
+    by strip so peak memory does not grow with resolution.
+    `budget` selects which pixels are used (see BIT_BUDGETS); max_bits
+    is ignored for "full". With the default "prefix" budget the results
+    match extract_lsb + chi_square_test / rs_analysis / sample_pair_stat.
+    SPA_rate, the sample pair estimate of the embedding rate (see
+    spa_rate), always uses every pixel whatever the budget: it needs
+    whole rows and columns of adjacent pairs, and costs a few array
+    passes over the channel.
+    Returns a dict keyed like the analysis_results.csv columns.
+    """
+    if budget not in BIT_BUDGETS:
+        raise ValueError(f"Unknown bit budget {budget!r}, expected one of {BIT_BUDGETS}")
+
+    img = load_image(image)
+    blue = img[:, :, :1]
+
+    strips = _iter_strips(blue, budget, max_bits, _strip_unit(block_size, group_size), seed)
+    features = _column_features(strips, 1, block_size, group_size)[0]
+    features["SPA_rate"] = spa_rate(img[:, :, 0])
+    return features
+
+
+# -------------------------------
+# Multi-Channel / Bit-Plane Analysis
+# -------------------------------
+
+# Channel names by channel count, in OpenCV order
+CHANNEL_NAMES = {
+    1: ("gray",),
+    2: ("gray", "alpha"),
+    3: ("blue", "green", "red"),
+    4: ("blue", "green", "red", "alpha"),
+}
+
+
+def channel_names(n_channels):
+    return CHANNEL_NAMES.get(n_channels, tuple(f"ch{c}" for c in range(n_channels)))
+
+
+def analyze_channels(image, planes=(0,), budget="prefix", max_bits=MAX_BITS,
+                     block_size=32, group_size=4, seed=0):
+    """
+    analyze_image features for every stored channel (including alpha and
+    grayscale, see load_image(unchanged=True)) and every bit-plane in
+    `planes` (0 = LSB, 1 = the bit above it), from one decode and one
+    pass over the pixels. Bit-plane p is analyzed as the LSB of
+    pixel >> p. All (plane, channel) columns share the same strips, so
+    the extra cost per column is a few array operations.
+    Returns {"<channel>_bit<plane>": features}, e.g. "green_bit0".
+    """
+    if budget not in BIT_BUDGETS:
+        raise ValueError(f"Unknown bit budget {budget!r}, expected one of {BIT_BUDGETS}")
+
+    img = load_image(image, unchanged=True)
+    names = channel_names(img.shape[2])
+    keys = [f"{name}_bit{p}" for p in planes for name in names]
+
+    def columns():
+        for pixels in _iter_strips(img, budget, max_bits, _strip_unit(block_size, group_size), seed):
+            yield np.concatenate([pixels >> p if p else pixels for p in planes], axis=1)
+
+    features = _column_features(columns(), len(keys), block_size, group_size)
+    for (p, c), values in zip([(p, c) for p in planes for c in range(img.shape[2])], features):
+        values["SPA_rate"] = spa_rate(img[:, :, c] >> p if p else img[:, :, c])
+    return dict(zip(keys, features))
+
+# -------------------------------
+# Batch Analysis
+# -------------------------------
+def _batch_channels(images):
+    # The analyzed (blue) channel of every image, as 2-D arrays
+    if isinstance(images, np.ndarray) and images.ndim == 3:
+        return list(images)
+    channels = []
+    for image in images:
+        if isinstance(image, np.ndarray) and image.ndim == 2:
+            channels.append(image)
+        else:
+            channels.append(load_image(image)[:, :, 0])
+    return channels
+
+
+def _prefix_pixels(channel, max_bits):
+    # First max_bits pixels in raster order, touching only the rows needed
+    rows = channel[:-(-max_bits // channel.shape[1])]
+    return rows.reshape(-1)[:max_bits]
+
+
+def analyze_batch(images, budget="prefix", max_bits=MAX_BITS,
+                  block_size=32, group_size=4, seed=0):
+    """
+    analyze_image features of many images in one call, as arrays.
+    `images` is an (N, H, W) stack of the channels to analyze, an
+    (N, H, W, C) stack of BGR images, or a list of anything load_image
+    accepts (a 2-D array is taken as the channel itself).
+
+    Images are analyzed in groups, each group as the columns of one
+    (pixels, images) stream, so chi-square, RS and sample-pair statistics
+    cost the same few array passes for the whole group as for one image.
+    With the "prefix" budget all images with at least max_bits pixels
+    can share a group whatever their size; otherwise images of the same
+    shape do. A group holds about STRIP_PIXELS selected pixels at most,
+    so "full" scans of large images are mostly analyzed one by one.
+    SPA_rate is computed image by image (it is a handful of passes over
+    every pixel, with nothing to share).
+
+    Returns {feature: float64 array of length N}, with NaN where
+    analyze_image would give None; values match analyze_image.
+    """
+    if budget not in BIT_BUDGETS:
+        raise ValueError(f"Unknown bit budget {budget!r}, expected one of {BIT_BUDGETS}")
+
+    channels = _batch_channels(images)
+    unit = _strip_unit(block_size, group_size)
+
+    groups = {}
+    for i, channel in enumerate(channels):
+        if budget == "prefix":
+            key = (min(max_bits, channel.size), channel.dtype)
+        else:
+            key = (channel.shape, channel.dtype)
+        groups.setdefault(key, []).append(i)
+
+    # Stacking pays off while the images' selected pixels are few; large
+    # scans already amortize the per-call work, so cap a group at about
+    # STRIP_PIXELS selected pixels
+    batches = []
+    for key, members in groups.items():
+        n_selected = key[0] if budget == "prefix" else np.prod(key[0])
+        if budget != "full":
+            n_selected = min(n_selected, max_bits)
+        per_batch = max(1, STRIP_PIXELS // max(int(n_selected), 1))
+        batches += [members[i:i + per_batch] for i in range(0, len(members), per_batch)]
+
+    results = [None] * len(channels)
+    for members in batches:
+        if budget == "prefix":
+            strips = [np.stack([_prefix_pixels(channels[i], max_bits) for i in members], axis=1)]
+        else:
+            stack = np.stack([channels[i] for i in members], axis=2)
+            strips = _iter_strips(stack, budget, max_bits, unit, seed)
+
+        features = _column_features(strips, len(members), block_size, group_size)
+        for i, values in zip(members, features):
+            values["SPA_rate"] = spa_rate(channels[i])
+            results[i] = values
+
+    columns = results[0].keys() if results else ()
+    return {
+        c: np.array([np.nan if r[c] is None else r[c] for r in results], dtype=np.float64)
+        for c in columns
+    }
+
+# -------------------------------
+# JPEG (DCT-Domain) Analysis
+# -------------------------------
+def is_jpeg(image):
+    """True if a path or encoded bytes hold a JPEG, judged by its magic bytes."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image[:len(JPEG_MAGIC)]) == JPEG_MAGIC
+    with open(image, "rb") as f:
+        return f.read(len(JPEG_MAGIC)) == JPEG_MAGIC
+
+
+@timed("jpeg_dct")
+def jpeg_ac_coefficients(image):
+    """
+    Quantized AC coefficients of a JPEG (path or bytes) usable for
+    embedding, i.e. all except 0 and 1 (as in JSteg), component by
+    component, block by block, in zigzag order within each block.
+    """
+    if not isinstance(image, (bytes, bytearray, memoryview)):
+        image = Path(image).read_bytes()
+    dct = read_dct_coefficients(image)
+    ac = np.concatenate([c["coefs"].reshape(-1, 64)[:, 1:].ravel() for c in dct["components"]])
+    return ac[(ac != 0) & (ac != 1)]
+
+
+@timed("pairs_of_values")
+def pairs_of_values_test(values, min_expected=5):
+    """
+    Westfeld-Pfitzmann chi-square over pairs of values (2i, 2i+1): LSB
+    embedding evens out the two counts of each pair. Pairs with fewer
+    than min_expected expected occurrences are left out.
+    Returns (chi, p); a p-value near 1 means the pairs look equalized.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if values.size == 0:
+        return None, None
+
+    lo = int(values.min()) & ~1
+    hist = np.bincount(values - lo)
+    if hist.size % 2:
+        hist = np.append(hist, 0)
+    pairs = hist.reshape(-1, 2)
+    expected = pairs.mean(axis=1)
+    keep = expected >= min_expected
+    if keep.sum() < 2:
+        return None, None
+
+    chi = float((((pairs[keep, 0] - expected[keep]) ** 2) / expected[keep]).sum())
+    return chi, float(chi2.sf(chi, df=int(keep.sum()) - 1))
+
+
+def analyze_jpeg(image, budget="prefix", max_bits=MAX_BITS, block_size=32, seed=0):
+    """
+    analyze_image counterpart for JPEG files, computed on the quantized
+    DCT coefficients instead of decoded pixels (spatial LSB statistics
+    say little about JPEGs). The coefficients are read straight from the
+    entropy-coded data (jpeg_dct), skipping IDCT and color conversion.
+
+    Chi-square and sample-pair features use the LSBs of the usable AC
+    coefficients (jpeg_ac_coefficients) selected by `budget`. RS analysis
+    and SPA (pixel-pair) analysis have no DCT-domain meaning, so RS_mean,
+    RS_std and SPA_rate are None. Also adds
+    the pairs-of-values chi-square on the coefficient histogram
+    (pov_chi, pov_p).
+    """
+    if budget not in BIT_BUDGETS:
+        raise ValueError(f"Unknown bit budget {budget!r}, expected one of {BIT_BUDGETS}")
+
+    coefs = jpeg_ac_coefficients(image)
+    if coefs.size:
+        strips = _iter_strips(coefs[None, :], budget, max_bits, _strip_unit(block_size, 2), seed)
+        coefs = np.concatenate(list(strips))
+
+    with stage("lsb_extract", coefs.nbytes):
+        lsbs = (coefs & 1).astype(np.uint8)
+    chi_mean, chi_std, chi_frac, chi_bias = chi_square_test(lsbs, block_size)
+    sp_ratio, sp_dev = sample_pair_stat(lsbs)
+    pov_chi, pov_p = pairs_of_values_test(coefs)
+
+    return {
+        "chi_mean": chi_mean,
+        "chi_std": chi_std,
+        "chi_frac_p_lt_0_05": chi_frac,
+        "chi_bias": chi_bias,
+        "RS_mean": None,
+        "RS_std": None,
+        "SP_equal_ratio": sp_ratio,
+        "SP_dev_from_0_5": sp_dev,
+        "SPA_rate": None,
+        "pov_chi": pov_chi,
+        "pov_p": pov_p,
+    }
+
+# -------------------------------
+# Clean Baseline Profile
 # -------------------------------
-def suspicious_score(lsb_array, image_path):
 
+# Written by run_analysis.py, loaded (once per process) by suspicious_score
+BASELINE_PROFILE = PROJECT_ROOT / "results" / "baseline_profile.json"
+
+# Features suspicious_score compares against the clean baseline
+BASELINE_FEATURES = ("SPA_rate", "chi_mean", "RS_mean")
+
+
+def raw_suspicious_score(features, baseline):
+    """
+    Weighted distance an image has moved away from a clean baseline.
+    Both arguments are dicts (or structured arrays) keyed like the
+    analysis_results.csv columns.
+    """
+    # Deltas: how far has this image moved away from the clean baseline
+    # (np.fmax so whole columns of a results table work as well, and a
+    # feature a detector could not compute (None / NaN) adds nothing)
+    def delta(m, sign=1):
+        diff = np.asarray(baseline[m], dtype=np.float64) - np.asarray(features[m], dtype=np.float64)
+        return np.fmax(sign * diff, 0.0)
+
+    # Embedding raises the estimated rate, but lowers chi-square and RS
+    spa_delta = delta("SPA_rate", sign=-1)
+    chi_delta = delta("chi_mean")
+    rs_delta = delta("RS_mean")
+
+    # Weighted combination into a raw suspicious score
+    return 0.5 * spa_delta + 0.3 * chi_delta + 0.2 * rs_delta
+
+
+def build_baseline_profile(clean_rows, max_raw_score, source="dataset/clean", budget="prefix"):
+    """
+    Summarize a clean corpus into the baseline used by suspicious_score:
+    the median of each baseline feature over the clean images, plus the
+    largest raw score seen when analyzing the corpus (used to normalize).
+    `budget` is the bit budget the rows were analyzed with; scores are
+    only comparable for features computed with the same one.
+    """
+    if len(clean_rows) == 0:
+        raise ValueError("Need at least one clean image to build a baseline profile")
+
+    profile = {
+        "source": source,
+        "n_images": len(clean_rows),
+        "detector_version": DETECTOR_VERSION,
+        "budget": budget,
+        "max_raw_score": float(max_raw_score),
+    }
+    for m in BASELINE_FEATURES:
+        values = np.array([row[m] for row in clean_rows], dtype=np.float64)
+        profile[m] = float(np.nanmedian(values)) if np.isfinite(values).any() else None
+    return profile
+
+
+def save_baseline_profile(profile, path=None):
+    # path defaults to BASELINE_PROFILE as it is when called (so it can be redirected)
+    path = Path(path or BASELINE_PROFILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    _load_profile.cache_clear()
+
+
+def load_baseline_profile(path=None):
+    """
+    The baseline profile at `path` (BASELINE_PROFILE as it is when
+    called, by default), read once per process and path.
+    """
+    return _load_profile(Path(path or BASELINE_PROFILE))
+
+
+@lru_cache(maxsize=None)
+def _load_profile(path):
+    if not path.exists():
+        raise FileNotFoundError(
+            f"No baseline profile at {path}; run run_analysis.py to create it"
+        )
+    with open(path) as f:
+        profile = json.load(f)
+    # Medians and normalizer from other detectors (or another scoring
+    # formula) would silently skew every score
+    if profile.get("detector_version") != DETECTOR_VERSION:
+        raise ValueError(
+            f"Baseline profile {path} was built with detector version "
+            f"{profile.get('detector_version')}, not {DETECTOR_VERSION}; "
+            "re-run run_analysis.py to rebuild it"
+        )
+    return profile
+
+
+# -------------------------------
+# Suspicious Score Calculation
+# -------------------------------
+def suspicious_score(lsb_array, image, profile=None):
+    """
+    Normalized suspicious score of one image against the clean baseline
+    profile (see load_baseline_profile).
+    """
     # --- compute stego stats ---
-    stego_rs_mean, stego_rs_std = rs_analysis(str(image_path))
-    stego_sp_ratio, stego_sp_dev = sample_pair_stat(lsb_array)
+    # Decode once; RS and SPA both work on the decoded array
+    img = load_image(image)
+    stego_rs_mean, stego_rs_std = rs_analysis(img)
+    stego_spa_rate = spa_rate(img[:, :, 0])
     stego_chi_mean, stego_chi_std, stego_chi_frac, stego_chi_bias = chi_square_test(lsb_array)
 
-    # --- load clean baseline (for now, hard-coded) ---
-    clean_lsb = extract_lsb("dataset/clean/img004.png")
-    clean_rs_mean, clean_rs_std = rs_analysis("dataset/clean/img004.png")
-    clean_sp_ratio, clean_sp_dev = sample_pair_stat(clean_lsb)
-    clean_chi_mean, clean_chi_std, clean_chi_frac, clean_chi_bias = chi_square_test(clean_lsb)
-
-    # --- compute deltas using the correct components ---
-    sp_delta = max(clean_sp_dev - stego_sp_dev, 0.0)
-    chi_delta = max(clean_chi_mean - stego_chi_mean, 0.0)
-    rs_delta = max(clean_rs_mean - stego_rs_mean, 0.0)
-
-    # --- weight combination ---
-    raw_score = 0.5 * sp_delta + 0.3 * chi_delta + 0.2 * rs_delta
-    norm_score = (raw_score - 0) / (4.506580523889968 - 0)
-    return norm_score
\ No newline at end of file
+    return score_features(
+        {"SPA_rate": stego_spa_rate, "chi_mean": stego_chi_mean, "RS_mean": stego_rs_mean},
+        profile,
+    )
+
+
+def score_features(features, profile=None):
+    """
+    Normalized suspicious score from already-computed features
+    (e.g. an analyze_image result), so no detector runs twice.
+    """
+    if profile is None:
+        profile = load_baseline_profile()
+
+    raw_score = raw_suspicious_score(features, profile)
+
+    max_raw = profile["max_raw_score"]
+    norm_score = raw_score / max_raw if max_raw > 0 else 0.0
+    return float(norm_score)
+
+
+def detection_report(image, budget="prefix", channels=False):
+    """
+    All single-image metrics (analyze_image features plus suspicious_score)
+    from one decode. A plain top-level function returning plain values, so
+    it can be shipped to a worker process.
+    With channels=True the report also holds a "channels" entry with the
+    features of every stored channel and of bit-planes 0 and 1 (see
+    analyze_channels), which takes a second, unchanged decode. The
+    top-level metrics stay those of the BGR uint8 view, the one the
+    baseline profile describes; channels and planes get no
+    suspicious_score, since scores against that profile would mean
+    nothing for them.
+    """
+    features = analyze_image(load_image(image), budget=budget)
+    features["suspicious_score"] = score_features(features)
+    if channels:
+        features["channels"] = analyze_channels(image, planes=(0, 1), budget=budget)
+    return features
+
+
+# -------------------------------
+# Triage
+# -------------------------------
+def _source_size(image):
+    if isinstance(image, np.ndarray):
+        return 0
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return len(image)
+    return Path(image).stat().st_size
+
+
+def read_image_rows(image, min_pixels=MAX_BITS):
+    """
+    The first rows of an image holding at least min_pixels pixels,
+    decoding as little as possible: PNGs are inflated only up to those
+    rows (png_rows) and .npy files only have those rows paged in; other
+    formats need a full decode. Returns (BGR rows, io_stats) with the
+    bytes read, bytes decoded and the decoded size of the whole image.
+    """
+    rows, io_stats, _ = _read_rows(image, min_pixels)
+    return rows, io_stats
+
+
+def _read_rows(image, min_pixels):
+    # read_image_rows, plus the whole decoded image when getting the rows
+    # took a full decode anyway (None otherwise), so it can be reused
+    if not isinstance(image, np.ndarray):
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            head = bytes(image[:len(PNG_MAGIC)])
+        else:
+            with open(image, "rb") as f:
+                head = f.read(len(PNG_MAGIC))
+        if head == PNG_MAGIC:
+            try:
+                return (*read_png_rows(image, min_pixels), None)
+            except ValueError:
+                pass  # interlaced, unusual or corrupt PNG: decode it whole below
+
+    img = load_image(image)
+    rows = img[:-(-min_pixels // img.shape[1])]
+    if isinstance(img, np.memmap):
+        # Only the header and the rows touched are read from disk
+        bytes_read = img.offset + rows.nbytes
+        bytes_decoded = rows.nbytes
+        full = None
+    else:
+        bytes_read = _source_size(image)
+        bytes_decoded = img.nbytes
+        full = img
+    return np.ascontiguousarray(rows), {
+        "bytes_read": int(bytes_read),
+        "bytes_decoded": int(bytes_decoded),
+        "bytes_full": int(img.nbytes),
+    }, full
+
+
+def triage_report(image, threshold=TRIAGE_THRESHOLD, budget=None, analyze_dct=None, profile=None):
+    """
+    Quick clean / suspicious call for bulk triage. Only the rows holding
+    the first MAX_BITS pixels are decoded (read_image_rows) and scored
+    with the default (prefix) features; below `threshold` the image is
+    reported clean with those features. Otherwise it escalates to a full
+    analysis with `budget`, by default the one the baseline profile was
+    built with, so the final score is comparable with the threshold and
+    with run_analysis scores. Formats without a partial decode are only
+    decoded once. `analyze_dct` (e.g. run_analysis.analyze_dct) gives the
+    DCT-domain features of a JPEG, or None to analyze its pixels.
+    Besides the features and suspicious_score, the report holds
+    "triage_score", "escalated", and the bytes read and decoded in total
+    ("bytes_read", "bytes_decoded") next to what one full decode takes
+    ("bytes_full", as extract_lsb decodes the whole image).
+    """
+    if profile is None:
+        profile = load_baseline_profile()
+    if budget is None:
+        budget = profile["budget"]
+
+    rows, io_stats, img = _read_rows(image, MAX_BITS)
+    features = analyze_image(rows)
+    score = score_features(features, profile)
+
+    report = {"triage_score": score, "escalated": score >= threshold}
+    if report["escalated"]:
+        dct = analyze_dct(image, budget=budget) if analyze_dct is not None else None
+        if dct is not None:
+            features = dct
+            io_stats["bytes_read"] += _source_size(image)
+        else:
+            if img is None:
+                img = load_image(image)
+                io_stats["bytes_read"] += _source_size(image)
+                io_stats["bytes_decoded"] += img.nbytes
+            features = analyze_image(img, budget=budget)
+        score = score_features(features, profile)
+
+    report.update(features)
+    report["suspicious_score"] = score
+    report.update(io_stats)
+    return report
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+# Read files in 1 MB pieces when hashing
+HASH_CHUNK = 1 << 20
+
+
+def fingerprint(params):
+    """
+    Short, stable hash of the detector version and parameters that
+    produced a set of features. Any change gives a different fingerprint,
+    so only entries computed with other settings stop matching.
+    """
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    On-disk (SQLite) cache of per-image features.
+
+    Features are keyed by file content hash plus a parameter fingerprint.
+    A second table remembers each path's size and mtime so unchanged files
+    are not re-hashed on every run.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path     TEXT PRIMARY KEY,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256   TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS features (
+                sha256      TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                features    TEXT NOT NULL,
+                PRIMARY KEY (sha256, fingerprint)
+            );
+        """)
+
+    def content_hash(self, path, known=None):
+        """
+        SHA-256 of a file's contents, reusing the stored hash when the
+        size and mtime have not changed since it was computed. `known` is
+        a (size, mtime_ns, sha256) computed elsewhere (e.g. by the corpus
+        manifest), used instead of reading the file when it still matches.
+        """
+        key = str(Path(path).resolve())
+        st = Path(path).stat()
+
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (key,)
+        ).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        if known is not None and known[2] is not None and tuple(known[:2]) == (st.st_size, st.st_mtime_ns):
+            digest = known[2]
+        else:
+            digest = file_sha256(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (key, st.st_size, st.st_mtime_ns, digest),
+        )
+        return digest
+
+    def get(self, digest, fp):
+        row = self.conn.execute(
+            "SELECT features FROM features WHERE sha256 = ? AND fingerprint = ?",
+            (digest, fp),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, digest, fp, features):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO features (sha256, fingerprint, features) VALUES (?, ?, ?)",
+            (digest, fp, json.dumps(features)),
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
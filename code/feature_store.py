@@ -0,0 +1,281 @@
+import csv
+import io
+import os
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+# Labels are stored as small integer codes: the position in this list
+LABELS = ["clean", "5percent", "10percent", "25percent"]
+CLEAN = LABELS.index("clean")
+
+# Per-image detector features (as returned by detect_lsb.analyze_image and
+# analyze_jpeg)
+FEATURE_COLUMNS = [
+    "chi_mean", "chi_std", "chi_frac_p_lt_0_05", "chi_bias",
+    "RS_mean", "RS_std", "SP_equal_ratio", "SP_dev_from_0_5", "SPA_rate",
+    "pov_chi", "pov_p",
+]
+
+# Filled in by run_analysis passes 2 and 3
+SCORE_COLUMNS = ["raw_suspicious_score", "suspicious_score", "susp_z"]
+
+# Columns of analysis_results.csv, in order
+CSV_COLUMNS = ["filename", "label", *FEATURE_COLUMNS, "suspicious_score", "susp_z"]
+
+# Columns of the append-only raw feature log written by run_analysis --stream;
+# the first RAW_KEY_COLUMNS identify one version of one image file
+RAW_COLUMNS = ["path", "size", "mtime_ns", "label", "fingerprint", *FEATURE_COLUMNS]
+RAW_KEY_COLUMNS = 3
+
+# Rows read or written at a time when streaming a CSV
+CSV_CHUNK_ROWS = 1 << 16
+
+# Bytes read at a time when looking back from the end of a log for its last line
+TAIL_CHUNK = 1 << 16
+
+
+def table_dtype(name_len):
+    return np.dtype(
+        [("filename", f"U{max(name_len, 1)}"), ("label", np.int8)]
+        + [(c, np.float64) for c in FEATURE_COLUMNS + SCORE_COLUMNS]
+    )
+
+
+def build_table(rows, spill_path=None):
+    """
+    Pack per-image result dicts into one columnar structured array with
+    integer label codes. With spill_path the table is a memory-mapped .npy
+    file instead of living in RAM. Missing features (None) become NaN.
+    """
+    name_len = max((len(r["filename"]) for r in rows), default=1)
+    dtype = table_dtype(name_len)
+
+    if spill_path is not None:
+        table = np.lib.format.open_memmap(spill_path, mode="w+", dtype=dtype, shape=(len(rows),))
+    else:
+        table = np.zeros(len(rows), dtype=dtype)
+
+    codes = {label: i for i, label in enumerate(LABELS)}
+    table["filename"] = [r["filename"] for r in rows]
+    table["label"] = [codes[r["label"]] for r in rows]
+    for c in FEATURE_COLUMNS:
+        table[c] = [np.nan if r[c] is None else r[c] for r in rows]
+    for c in SCORE_COLUMNS:
+        table[c] = 0.0
+
+    return table
+
+
+def label_counts(table):
+    return np.bincount(table["label"], minlength=len(LABELS))
+
+
+def group_mean_std(table, column):
+    """
+    Per-label count, mean and population std of one column, with a
+    bincount group-by (two passes over the column, no per-label scans).
+    Missing values (NaN, e.g. RS features of JPEG rows) are left out.
+    """
+    present = ~np.isnan(table[column])
+    codes = table["label"][present]
+    values = table[column][present]
+    counts = np.bincount(codes, minlength=len(LABELS))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.bincount(codes, weights=values, minlength=len(LABELS)) / counts
+        sq_dev = (values - means[codes]) ** 2
+        stds = np.sqrt(np.bincount(codes, weights=sq_dev, minlength=len(LABELS)) / counts)
+
+    return counts, means, stds
+
+
+def counts_at_or_above(table, column, thresholds):
+    """
+    (labels x thresholds) matrix with the number of images of each label
+    whose `column` is >= each threshold. The column is sorted once (by
+    label, then value) and every threshold is a binary search.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    order = np.lexsort((table[column], table["label"]))
+    codes = table["label"][order]
+    values = table[column][order]
+
+    bounds = np.searchsorted(codes, np.arange(len(LABELS) + 1))
+    out = np.zeros((len(LABELS), len(thresholds)), dtype=np.int64)
+    for code in range(len(LABELS)):
+        segment = values[bounds[code]:bounds[code + 1]]
+        out[code] = segment.size - np.searchsorted(segment, thresholds, side="left")
+    return out
+
+
+def write_csv(table, path):
+    """
+    Write the table in the analysis_results.csv layout (NaN written as
+    empty), CSV_CHUNK_ROWS rows at a time.
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+
+        for start in range(0, len(table), CSV_CHUNK_ROWS):
+            chunk = table[start:start + CSV_CHUNK_ROWS]
+            columns = [
+                chunk["filename"].tolist(),
+                [LABELS[code] for code in chunk["label"].tolist()],
+            ]
+            for c in CSV_COLUMNS[2:]:
+                columns.append(["" if v != v else v for v in chunk[c].tolist()])
+            writer.writerows(zip(*columns))
+
+
+class RawFeatureLog:
+    """
+    Append-only CSV of per-image raw features, one row per analyzed image.
+
+    Rows are buffered and appended batch_size at a time in one write that
+    is flushed to disk, so an interrupted run loses at most one batch.
+    Each row is keyed by the image's (path, size, mtime_ns), as strings,
+    so an image edited in place gets a new key and is analyzed again.
+    Opening an existing log resumes it: `done` holds the keys already
+    recorded, read from the log row by row. A log written with another
+    detector fingerprint (or in another layout) is started over.
+    """
+
+    def __init__(self, path, fp, batch_size=256):
+        self.path = Path(path)
+        self.fp = fp
+        self.batch_size = batch_size
+        self.pending = []
+        self.done = self._resume()
+
+    def _truncate_partial_line(self):
+        # Drop a partial last line left by a crash mid-write, reading back
+        # from the end of the file only as far as its last newline
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                step = min(TAIL_CHUNK, end)
+                f.seek(end - step)
+                newline = f.read(step).rfind(b"\n")
+                if newline >= 0:
+                    end += newline + 1 - step
+                    break
+                end -= step
+            if end < size:
+                f.truncate(end)
+
+    def _read_done(self):
+        # Keys recorded in the log, or None if it was written differently
+        fp_col = RAW_COLUMNS.index("fingerprint")
+        done = set()
+        with open(self.path, newline="") as f:
+            reader = csv.reader(f)
+            if next(reader, None) != RAW_COLUMNS:
+                return None
+            for row in reader:
+                if not row:
+                    continue
+                if row[fp_col] != self.fp:
+                    return None
+                done.add(tuple(row[:RAW_KEY_COLUMNS]))
+        return done
+
+    def _resume(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.path.exists():
+            self._truncate_partial_line()
+            done = self._read_done()
+            if done is not None:
+                return done
+            print(f"{self.path.name}: written with other detector settings, starting over")
+
+        with open(self.path, "w", newline="") as f:
+            csv.writer(f).writerow(RAW_COLUMNS)
+        return set()
+
+    def append(self, key, row):
+        """Record the features of the image stored under `key` (path, size, mtime_ns)."""
+        values = ["" if row[c] is None else row[c] for c in FEATURE_COLUMNS]
+        self.pending.append([*key, row["label"], self.fp, *values])
+        self.done.add(key)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        buf = io.StringIO()
+        csv.writer(buf).writerows(self.pending)
+        with open(self.path, "a", newline="") as f:
+            f.write(buf.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _iter_raw_chunks(path, keep):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        while True:
+            chunk = list(islice(reader, CSV_CHUNK_ROWS))
+            if not chunk:
+                return
+            yield [
+                row for row in chunk
+                if row and (keep is None or tuple(row[:RAW_KEY_COLUMNS]) in keep)
+            ]
+
+
+def load_raw_table(path, keep=None, spill_path=None):
+    """
+    Build the results table from a RawFeatureLog file, reading it
+    CSV_CHUNK_ROWS rows at a time (one pass to size the table, one to
+    fill it). Only rows whose key (see RawFeatureLog) is in `keep` are
+    loaded when it is given.
+    """
+    n_rows = 0
+    name_len = 1
+    for chunk in _iter_raw_chunks(path, keep):
+        n_rows += len(chunk)
+        name_len = max([name_len] + [len(Path(row[0]).name) for row in chunk])
+
+    dtype = table_dtype(name_len)
+    if spill_path is not None:
+        table = np.lib.format.open_memmap(spill_path, mode="w+", dtype=dtype, shape=(n_rows,))
+    else:
+        table = np.zeros(n_rows, dtype=dtype)
+
+    codes = {label: i for i, label in enumerate(LABELS)}
+    start = 0
+    for chunk in _iter_raw_chunks(path, keep):
+        if not chunk:
+            continue
+        part = table[start:start + len(chunk)]
+        part["filename"] = [Path(row[0]).name for row in chunk]
+        part["label"] = [codes[row[RAW_KEY_COLUMNS]] for row in chunk]
+
+        # Empty cells are missing features
+        values = np.array([row[RAW_KEY_COLUMNS + 2:] for row in chunk])
+        values[values == ""] = "nan"
+        values = values.astype(np.float64)
+        for j, c in enumerate(FEATURE_COLUMNS):
+            part[c] = values[:, j]
+        for c in SCORE_COLUMNS:
+            part[c] = 0.0
+        start += len(chunk)
+
+    return table
@@ -1,8 +1,129 @@
-from nicegui import ui
+from nicegui import ui, run
+import asyncio
+import csv
+import io
 import os
-from detect_lsb import extract_lsb, chi_square_test, rs_analysis, sample_pair_stat, suspicious_score
+import statistics
+import time
+import zipfile
+from functools import partial
+import cv2
+import numpy as np
+from detect_lsb import detection_report, load_baseline_profile
 import base64
-from run_analysis import main as run_dataset_analysis
+
+#Load the clean baseline profile once at startup (it is memoized for every detection)
+load_baseline_profile()
+
+#Detection runs in NiceGUI's process pool so the event loop stays responsive.
+#This caps how many detections run at once across every connected user;
+#extra requests wait for a free slot instead of piling onto the pool
+MAX_CONCURRENT_DETECTIONS = os.cpu_count() or 1
+_detection_slots = None
+
+
+#The semaphore is created on first use, inside NiceGUI's running event loop
+#(made at import time it would be bound to another loop on Python < 3.10)
+def detection_slots():
+    global _detection_slots
+    if _detection_slots is None:
+        _detection_slots = asyncio.Semaphore(MAX_CONCURRENT_DETECTIONS)
+    return _detection_slots
+
+#Uploads are analyzed straight from memory. Set SAVE_UPLOADS to also keep a
+#copy in UPLOAD_DIR; copies older than UPLOAD_RETENTION_SECONDS are deleted
+SAVE_UPLOADS = False
+UPLOAD_DIR = "uploads"
+UPLOAD_RETENTION_SECONDS = 24 * 60 * 60
+
+#Longest side (in pixels) of the upload preview
+THUMBNAIL_SIZE = 256
+
+
+#Make a small JPEG preview so the browser does not get the full upload back
+def make_thumbnail(data, max_side=THUMBNAIL_SIZE):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    #Reduced decode is much cheaper for JPEGs and fine for a preview
+    img = cv2.imdecode(buf, cv2.IMREAD_REDUCED_COLOR_2)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return encoded.tobytes() if ok else None
+
+
+#Delete saved uploads that are older than the retention period
+def cleanup_uploads():
+    if not os.path.isdir(UPLOAD_DIR):
+        return
+    cutoff = time.time() - UPLOAD_RETENTION_SECONDS
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+#Optionally keep a copy of the upload on disk (basename only, so a crafted
+#file name can not write outside UPLOAD_DIR)
+def save_upload(name, data):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    with open(os.path.join(UPLOAD_DIR, os.path.basename(name)), "wb") as f:
+        f.write(data)
+    cleanup_uploads()
+
+#Apply the retention policy to copies left over from earlier runs
+if SAVE_UPLOADS:
+    cleanup_uploads()
+
+#Columns of the batch table and its CSV export (same as results/analysis_results.csv)
+BATCH_COLUMNS = [
+    "filename", "label", "chi_mean", "chi_std", "chi_frac_p_lt_0_05", "chi_bias",
+    "RS_mean", "RS_std", "SP_equal_ratio", "SP_dev_from_0_5", "SPA_rate", "suspicious_score", "susp_z",
+]
+
+
+#Split an upload into (name, read) images, read() giving the image bytes.
+#A .zip is opened in memory, but each member is only decompressed by its
+#read(), when its turn comes, so a large archive is never unpacked at once
+def unpack_upload(name, data):
+    if not zipfile.is_zipfile(io.BytesIO(data)):
+        return [(name, lambda: data)]
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    images = []
+    for info in archive.infolist():
+        member = os.path.basename(info.filename)
+        #Skip folders and macOS metadata (__MACOSX/, ._files, .DS_Store)
+        if info.is_dir() or not member or member.startswith(".") or "__MACOSX" in info.filename:
+            continue
+        images.append((member, partial(archive.read, info)))
+    return images
+
+
+#CSV text in the analysis_results.csv layout, with susp_z over this batch
+def batch_csv(rows):
+    scores = [r["suspicious_score"] for r in rows]
+    mean_score = statistics.mean(scores) if scores else 0.0
+    std_score = statistics.pstdev(scores) if len(scores) > 1 else 0.0
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=BATCH_COLUMNS)
+    writer.writeheader()
+    for r in rows:
+        z = (r["suspicious_score"] - mean_score) / std_score if std_score > 0.0 else 0.0
+        writer.writerow({**r, "susp_z": z})
+    return out.getvalue()
+
+#One markdown line per channel / bit-plane of a detection_report(channels=True).
+#Raw features only: the suspicious score is calibrated on the blue LSB plane
+def channel_lines(channels):
+    return "\n".join(
+        f"    - **{name}:** "
+        f"Chi² {f['chi_mean']:.4f}, RS {f['RS_mean']:.4f}, SPA {f['SPA_rate']:.4f}"
+        for name, f in channels.items()
+    )
 
 def run_analysis():
     #Hide the upload percentage tracker cause it can be quite misleading
@@ -15,7 +136,7 @@ def run_analysis():
     """)
 
 
-    uploaded_path = {"value": None}  #store the path of the uloaded images
+    uploaded = {"name": None, "data": None}  #the last uploaded image, kept in memory
     image_preview = ui.image().classes('w-64 h-auto') #Create a preview for the images
     result_box = ui.markdown("") #For the analysis results
 
@@ -27,75 +148,196 @@ def run_analysis():
             ui.notify("Upload failed!", color="red")
             return
 
-        #Make sure "uploads" folder exist"
-        #Following the detect_lsb.py, it needs a file path so I just create a folder for testing
-        os.makedirs("uploads", exist_ok=True) 
         data = await file.read()
+        uploaded["name"] = file.name
+        uploaded["data"] = data
 
-        #Save the uploaded file images to the "uploads" folder
-        save_path = os.path.join("uploads", file.name)
-
-        with open(save_path, "wb") as f:
-            f.write(data)
+        if SAVE_UPLOADS:
+            await run.io_bound(save_upload, file.name, data)
 
-        uploaded_path["value"] = save_path 
-        #Showcase the uploaded image
-        encoded = base64.b64encode(data).decode("utf-8")
-        mime = file.type or "image/png"
-        image_preview.set_source(f"data:{mime};base64,{encoded}")
+        #Showcase a downscaled preview of the uploaded image
+        thumbnail = await run.io_bound(make_thumbnail, data)
+        if thumbnail is not None:
+            encoded = base64.b64encode(thumbnail).decode("utf-8")
+            image_preview.set_source(f"data:image/jpeg;base64,{encoded}")
 
         #To notify the user that it was uploaded successfully
         ui.notify("Uploaded successfully!", color="green")
 
+    running = {"task": None}  #the detection currently running for this page, if any
+
+    #Wait for a free slot, then run every detector in a worker process.
+    #The upload bytes are decoded there with cv2.imdecode, never via disk
+    async def detect_in_background(data):
+        async with detection_slots():
+            status_label.set_text("Analyzing...")
+            return await run.cpu_bound(detection_report, data, channels=True)
+
     #This method is to run the detection form detect_lab.py
-    def run_detection():
-        if uploaded_path["value"] is None:
+    async def run_detection():
+        if uploaded["data"] is None:
             ui.notify("Upload an image!", color="red")
-            print("Uploaded path:", uploaded_path)
             return
 
+        if running["task"] is not None:
+            ui.notify("Detection is already running", color="orange")
+            return
+
+        status_label.set_text("Waiting for a free worker...")
+        progress.set_visibility(True)
+        cancel_button.set_visibility(True)
+
+        task = asyncio.ensure_future(detect_in_background(uploaded["data"]))
+        running["task"] = task
+
         try:
-            path = uploaded_path["value"]
-            lsbs = extract_lsb(uploaded_path["value"])
-            susscore = suspicious_score(lsbs, path)
-            chi_mean, chi_std, frac_sig, chi_bias = chi_square_test(lsbs)
-            rs_mean, rs_std = rs_analysis(uploaded_path["value"])
-            sp_ratio, sp_dev = sample_pair_stat(lsbs)
+            report = await task
 
             result_box.set_content(f"""
     #Steganography Analysis Report
 
     ###Chi-Square Test
-    - **Mean Chi²:** {chi_mean:.4f}
-    - **Std Dev:** {chi_std:.4f}
-    - **Fraction p<0.05:** {frac_sig:.4f}
-    - **LSB Bias:** {chi_bias:.4f}
+    - **Mean Chi²:** {report["chi_mean"]:.4f}
+    - **Std Dev:** {report["chi_std"]:.4f}
+    - **Fraction p<0.05:** {report["chi_frac_p_lt_0_05"]:.4f}
+    - **LSB Bias:** {report["chi_bias"]:.4f}
 
     ---
 
     ###RS Analysis
-    - **RS Mean:** {rs_mean:.4f}
-    - **RS Std Dev:** {rs_std:.4f}
+    - **RS Mean:** {report["RS_mean"]:.4f}
+    - **RS Std Dev:** {report["RS_std"]:.4f}
 
     ---
 
     ###Sample Pair Analysis
-    - **Equal Pair Ratio:** {sp_ratio:.4f}
-    - **Deviation from 0.5:** {sp_dev:.4f}
+    - **Equal Pair Ratio:** {report["SP_equal_ratio"]:.4f}
+    - **Deviation from 0.5:** {report["SP_dev_from_0_5"]:.4f}
+    - **Estimated Embedding Rate:** {report["SPA_rate"]:.4f}
 
     ###Suspicious Score
-    - {susscore:.4f}
+    - {report["suspicious_score"]:.4f}
+
+    ---
+
+    ###Per Channel and Bit-Plane
+{channel_lines(report["channels"])}
     """)
 
             ui.notify("Analysis done!", color="green")
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            ui.notify("Detection cancelled", color="orange")
         except Exception as e:
             ui.notify(str(e), color="red")
+        finally:
+            running["task"] = None
+            status_label.set_text("")
+            progress.set_visibility(False)
+            cancel_button.set_visibility(False)
+
+    #Stop waiting for the current detection. A worker that already started
+    #finishes in the background, but its result is thrown away
+    def cancel_detection():
+        if running["task"] is not None:
+            running["task"].cancel()
 
     #UI layout for the buttons and run the UI
     with ui.column().classes('items-center justify-center w-full'):
         ui.label("LSB Steganography Detector").classes("text-2xl font-bold")
         ui.upload(on_upload=handle_upload, label="Upload Image")
         ui.button("Run Detection", on_click=run_detection)
+        with ui.row().classes('items-center'):
+            progress = ui.spinner(size='lg')
+            status_label = ui.label("")
+            cancel_button = ui.button("Cancel", on_click=cancel_detection, color="red")
+        progress.set_visibility(False)
+        cancel_button.set_visibility(False)
+
+def run_batch_triage():
+    batch_rows = []  #full-precision results, in completion order
+    counts = {"queued": 0, "done": 0, "failed": 0}
+    pending = set()  #queued / running analyses, so they are not garbage collected
+
+    def update_status():
+        batch_status.set_text(
+            f"Queued: {counts['queued']}  Done: {counts['done']}  Failed: {counts['failed']}"
+        )
+
+    #Read one image and analyze it in the shared worker pool once a slot is
+    #free, then stream its row into the table
+    async def analyze_queued(name, read):
+        try:
+            async with detection_slots():
+                data = await run.io_bound(read)
+                report = await run.cpu_bound(detection_report, data)
+        except Exception as e:
+            counts["failed"] += 1
+            ui.notify(f"{name}: {e}", color="red")
+        else:
+            row = {"filename": name, "label": "upload", **report}
+            batch_rows.append(row)
+            #The table shows rounded values; the CSV export keeps full precision
+            shown = {k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()}
+            shown["id"] = len(batch_rows)
+            table.add_row(shown)
+            counts["done"] += 1
+        finally:
+            counts["queued"] -= 1
+            update_status()
+
+    #Every uploaded file (or every image inside an uploaded .zip) is queued
+    #right away; detection_slots decides how many run at once
+    async def handle_batch_upload(e):
+        file = e.file
+        if not file:
+            ui.notify("Upload failed!", color="red")
+            return
+
+        data = await file.read()
+        images = await run.io_bound(unpack_upload, file.name, data)
+        for name, read in images:
+            counts["queued"] += 1
+            task = asyncio.ensure_future(analyze_queued(name, read))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        update_status()
+
+    def export_csv():
+        if not batch_rows:
+            ui.notify("No results to export yet", color="red")
+            return
+        ui.download.content(batch_csv(batch_rows), "analysis_results.csv", "text/csv")
+
+    #Cancel everything still queued or running (a worker that already started
+    #finishes in the background, but its row is thrown away), then clear
+    def clear_results():
+        for task in list(pending):
+            task.cancel()
+        counts["done"] = 0
+        counts["failed"] = 0
+        batch_rows.clear()
+        table.rows.clear()
+        table.update()
+        update_status()
+
+    with ui.column().classes('items-center justify-center w-full'):
+        ui.label("Batch Triage").classes("text-2xl font-bold")
+        ui.upload(
+            on_upload=handle_batch_upload, multiple=True, auto_upload=True,
+            label="Upload Images or a .zip",
+        )
+        batch_status = ui.label("")
+        with ui.row():
+            ui.button("Export CSV", on_click=export_csv)
+            ui.button("Clear", on_click=clear_results, color="grey")
+        columns = [
+            {"name": c, "label": c, "field": c, "sortable": True, "align": "left"}
+            for c in BATCH_COLUMNS if c != "susp_z"
+        ]
+        table = ui.table(columns=columns, rows=[], row_key="id", pagination=25).classes("w-full")
+    update_status()
 
 ui.label("LSB Steganography Detector").classes(
     "text-3xl font-bold py-4 w-full text-center sticky top-0 bg-white z-50 shadow"
@@ -103,11 +345,14 @@ ui.label("LSB Steganography Detector").classes(
 
 with ui.tabs().classes('w-full') as tabs:
     one = ui.tab('Detect LSB')
+    batch = ui.tab('Batch Triage')
     two = ui.tab('About This Project')
 with ui.tab_panels(tabs, value=one).classes('w-full'):
     with ui.tab_panel(one):
         with ui.row().classes('w-full items-center justify-center'):
             run_analysis()
+    with ui.tab_panel(batch):
+        run_batch_triage()
     with ui.tab_panel(two):
         with ui.card().classes("w-full bg-gray-100 p-6 text-center items-center justify-center"):
             ui.label("Summary").classes("text-2xl font-bold mb-2")
@@ -1,18 +1,41 @@
+import argparse
+import io
 import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 import numpy as np
 import cv2
 import csv
-import random
 
-# Set a seed for reproducibility (optional)
-random.seed(42)
-np.random.seed(42)
+# Base seed for reproducibility; each image gets its own generator derived
+# from this, its file name and the payload ratio (see image_rng)
+SEED = 42
 
 # Paths
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 CLEAN_DIR = PROJECT_ROOT / "dataset" / "clean"
 STEGO_BASE_DIR = PROJECT_ROOT / "dataset" / "stego"
+MAPPING_CSV = STEGO_BASE_DIR / "stego_mapping.csv"
+MAPPING_HEADER = ["clean_image", "stego_image", "payload_label", "payload_ratio"]
+
+# Output containers: "png" (default) or "npy" (uncompressed, memory-mappable
+# NumPy array; much faster to write and read, for internal benchmark corpora
+# where file size doesn't matter). detect_lsb.load_image reads both.
+OUTPUT_FORMATS = ("png", "npy")
+
+# PNG encoder settings. Compression is the zlib level (0 = store, 9 = smallest);
+# None keeps OpenCV's default. On large corpora the zlib encode dominates
+# generation time, so a low level or "huffman"/"rle" is much faster.
+PNG_COMPRESSION = None
+PNG_STRATEGIES = {
+    "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    "huffman": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED,
+}
 
 # Payload ratios (5%, 10%, 25% of pixels)
 PAYLOAD_RATIOS = {
@@ -21,12 +44,92 @@ PAYLOAD_RATIOS = {
     "25percent": 0.25,
 }
 
-def embed_random_lsb_png(input_path: Path, output_path: Path, payload_ratio: float, channel: int = 0):
+def image_rng(image_name: str, payload_ratio: float, seed: int = SEED):
+    """
+    Independent, reproducible generator for one (image, payload) pair, so
+    images can be produced in any order or in parallel with the same result.
+    """
+    name_key = zlib.crc32(image_name.encode("utf-8"))
+    ratio_key = int(round(payload_ratio * 1_000_000))
+    return np.random.default_rng([seed, name_key, ratio_key])
+
+
+def sample_pixel_indices(rng: np.random.Generator, total: int, k: int):
+    """
+    k distinct, sorted indices in [0, total). Sparse payloads are sampled
+    with replacement and topped up until unique, so time and memory
+    depend on k rather than on the image size.
+    """
+    if 2 * k > total:
+        # Dense payload: a full permutation costs about the same as k
+        return np.sort(rng.permutation(total)[:k])
+
+    # Draw enough with replacement that slightly more than k are expected
+    # to be distinct, so one round is almost always enough
+    draws = int(-total * np.log1p(-k / total) * 1.01) + 16
+    chosen = _sorted_unique(rng.integers(0, total, size=draws, dtype=np.int64))
+
+    while chosen.size < k:
+        extra = rng.integers(0, total, size=k - chosen.size, dtype=np.int64)
+        chosen = _sorted_unique(np.concatenate([chosen, extra]))
+
+    if chosen.size > k:
+        # Drop the (small) surplus at random
+        surplus = sample_pixel_indices(rng, chosen.size, chosen.size - k)
+        chosen = np.delete(chosen, surplus)
+    return chosen
+
+
+def _sorted_unique(values):
+    # Plain sort + neighbor compare; cheaper than np.unique for large int arrays
+    values = np.sort(values)
+    keep = np.ones(values.size, dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return values[keep]
+
+
+def embed_random_lsb(img: np.ndarray, payload_ratio: float, rng: np.random.Generator, channel: int = 0):
+    """
+    Overwrite the LSB of a random payload_ratio share of one channel's
+    pixels with random bits, in place. `img` must be a contiguous
+    (h, w, c) array. Returns the flat positions that were written and
+    their previous values (so the caller can undo the embedding), or
+    None if the payload is empty.
+    """
+    h, w, c = img.shape
+    total_pixels = h * w
+    num_payload_bits = int(total_pixels * payload_ratio)
+
+    if num_payload_bits == 0:
+        return None
+
+    # Randomly pick which pixels to modify
+    selected_indices = sample_pixel_indices(rng, total_pixels, num_payload_bits)
+
+    # Generate random bits to embed
+    payload_bits = rng.integers(0, 2, size=num_payload_bits, dtype=np.uint8)
+
+    # Flat view of the whole image: pixel i of `channel` is at i * c + channel
+    flat = img.reshape(-1)
+    positions = selected_indices * c + channel
+    previous = flat[positions]
+
+    # Clear LSB and set to payload bit
+    # new_value = (old_value & 0b11111110) | bit
+    flat[positions] = (previous & 0xFE) | payload_bits
+    return positions, previous
+
+
+def read_for_embedding(input_path: Path, channel: int = 0):
+    """
+    Decode an image as a contiguous (h, w, c) array and resolve which
+    channel to embed into. Returns (None, channel) if it can't be read.
+    """
     img = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
 
     if img is None:
         print(f"Warning: could not read {input_path}")
-        return False
+        return None, channel
 
     # Handle grayscale vs RGB(A)
     if img.ndim == 2:
@@ -39,83 +142,203 @@ def embed_random_lsb_png(input_path: Path, output_path: Path, payload_ratio: flo
         # If requested channel doesn't exist, just use the last channel
         channel = c - 1
 
-    # Work on a copy
-    stego = img.copy()
-    chan = stego[:, :, channel]
+    return img, channel
 
-    total_pixels = h * w
-    num_payload_bits = int(total_pixels * payload_ratio)
 
-    if num_payload_bits == 0:
-        print(f"Payload ratio too small for {input_path}, skipping.")
-        return False
+def write_stego(output_path: Path, img: np.ndarray, png_compression=PNG_COMPRESSION, png_strategy="default"):
+    """
+    Write a stego image losslessly; the container follows the file
+    extension (.npy for a raw NumPy array, otherwise PNG).
+    """
+    if Path(output_path).suffix == ".npy":
+        np.save(output_path, img)
+        return True
 
-    # Flatten indices and randomly pick which pixels to modify
-    all_indices = np.arange(total_pixels)
-    np.random.shuffle(all_indices)
-    selected_indices = all_indices[:num_payload_bits]
+    params = []
+    if png_compression is not None:
+        params += [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    if png_strategy != "default":
+        params += [cv2.IMWRITE_PNG_STRATEGY, PNG_STRATEGIES[png_strategy]]
+    return cv2.imwrite(str(output_path), img, params)
 
-    # Generate random bits to embed
-    payload_bits = np.random.randint(0, 2, size=num_payload_bits, dtype=np.uint8)
 
-    # Flatten the channel for easy indexing
-    flat_chan = chan.flatten()
+def embed_random_lsb_png(input_path: Path, output_path: Path, payload_ratio: float, channel: int = 0, rng=None,
+                         png_compression=PNG_COMPRESSION, png_strategy="default"):
+    img, channel = read_for_embedding(input_path, channel)
+    if img is None:
+        return False
 
-    # Clear LSB and set to payload bit
-    # new_value = (old_value & 0b11111110) | bit
-    flat_chan[selected_indices] = (flat_chan[selected_indices] & 0xFE) | payload_bits
+    if rng is None:
+        rng = image_rng(Path(input_path).name, payload_ratio)
 
-    # Reshape back to 2D
-    stego[:, :, channel] = flat_chan.reshape(h, w)
+    # The freshly decoded image is ours, so embed in place instead of copying
+    if embed_random_lsb(img, payload_ratio, rng, channel) is None:
+        print(f"Payload ratio too small for {input_path}, skipping.")
+        return False
 
     # Ensure output directory exists
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Save as PNG
-    success = cv2.imwrite(str(output_path), stego)
+    # Save as PNG (or .npy, see write_stego)
+    success = write_stego(output_path, img, png_compression, png_strategy)
     if not success:
         print(f"Error: could not write stego image {output_path}")
     return success
 
-def main():
-    # Prepare CSV log of what we created
-    log_path = STEGO_BASE_DIR / "stego_mapping.csv"
+def stego_name(clean_path: Path, label: str, fmt: str = "png"):
+    return f"{clean_path.stem}_{label}.{fmt}"
+
+
+def generate_payload_levels(clean_path: Path, levels, channel: int = 0, fmt: str = "png",
+                            png_compression=PNG_COMPRESSION, png_strategy="default"):
+    """
+    Decode one clean image once and write a stego image (PNG or .npy) for
+    every (label, ratio) in `levels`. Each embedding is undone after writing, so
+    every level starts from the clean pixels without copying the image.
+    Returns the mapping rows of the outputs that were written.
+    """
+    img, channel = read_for_embedding(clean_path, channel)
+    if img is None:
+        return []
+
+    flat = img.reshape(-1)
+    rows = []
+
+    for label, ratio in levels:
+        out_name = stego_name(clean_path, label, fmt)
+        out_path = STEGO_BASE_DIR / label / out_name
+
+        embedded = embed_random_lsb(img, ratio, image_rng(clean_path.name, ratio), channel)
+        if embedded is None:
+            print(f"Payload ratio too small for {clean_path}, skipping.")
+            continue
+
+        ok = write_stego(out_path, img, png_compression, png_strategy)
+
+        positions, previous = embedded
+        flat[positions] = previous
+
+        if ok:
+            rows.append([clean_path.name, out_name, label, ratio])
+        else:
+            print(f"Error: could not write stego image {out_path}")
+
+    return rows
+
+
+def read_mapping(log_path: Path):
+    """
+    Set of (clean_image, stego_image, payload_label) entries already
+    recorded in the mapping file.
+    """
+    if not log_path.exists():
+        return set()
+    with open(log_path, newline="") as f:
+        return {
+            (row["clean_image"], row["stego_image"], row["payload_label"])
+            for row in csv.DictReader(f)
+        }
+
+
+def append_mapping_rows(log_path: Path, rows):
+    """
+    Append rows to the mapping in one write, flushed to disk before
+    returning, so an interrupted run never leaves a half-written line.
+    """
+    if not rows:
+        return
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    with open(log_path, "a", newline="") as f:
+        f.write(buf.getvalue())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def main(workers=None, fmt="png", png_compression=PNG_COMPRESSION, png_strategy="default"):
+    # Prepare CSV log of what we created (appended to, never rewritten)
+    log_path = MAPPING_CSV
     log_path.parent.mkdir(parents=True, exist_ok=True)
+    if not log_path.exists() or log_path.stat().st_size == 0:
+        append_mapping_rows(log_path, [MAPPING_HEADER])
+
+    png_files = sorted(CLEAN_DIR.glob("*.png"))
+
+    if not png_files:
+        print(f"No PNG files found in {CLEAN_DIR}")
+        return
 
-    with open(log_path, "w", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["clean_image", "stego_image", "payload_label", "payload_ratio"])
+    for label in PAYLOAD_RATIOS:
+        (STEGO_BASE_DIR / label).mkdir(parents=True, exist_ok=True)
 
-        png_files = sorted(CLEAN_DIR.glob("*.png"))
+    # Only (image, payload) pairs that are missing from the mapping or
+    # from disk are generated, so a run can be resumed or extended
+    done = read_mapping(log_path)
+    jobs = []
+    for clean_path in png_files:
+        levels = []
+        for label, ratio in PAYLOAD_RATIOS.items():
+            out_name = stego_name(clean_path, label, fmt)
+            recorded = (clean_path.name, out_name, label) in done
+            if not (recorded and (STEGO_BASE_DIR / label / out_name).exists()):
+                levels.append((label, ratio))
+        if levels:
+            jobs.append((clean_path, levels))
 
-        if not png_files:
-            print(f"No PNG files found in {CLEAN_DIR}")
-            return
+    skipped = len(png_files) - len(jobs)
+    print(f"{len(jobs)} clean images to process, {skipped} already complete")
 
-        for clean_path in png_files:
-            clean_name = clean_path.name
-            stem = clean_path.stem
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
 
-            for label, ratio in PAYLOAD_RATIOS.items():
-                out_dir = STEGO_BASE_DIR / label
-                out_dir.mkdir(parents=True, exist_ok=True)
+    paths = [clean_path for clean_path, _ in jobs]
+    levels = [lv for _, lv in jobs]
+    channels = [0] * len(jobs)  # blue channel (0=B, 1=G, 2=R) if RGB
 
-                out_name = f"{stem}_{label}.png"
-                out_path = out_dir / out_name
+    def record(rows):
+        # A regenerated file that is already in the mapping is not listed twice
+        append_mapping_rows(log_path, [r for r in rows if tuple(r[:3]) not in done])
 
-                ok = embed_random_lsb_png(
-                    input_path=clean_path,
-                    output_path=out_path,
-                    payload_ratio=ratio,
-                    channel=0,  # blue channel (0=B, 1=G, 2=R) if RGB
-                )
+    generate = partial(
+        generate_payload_levels,
+        fmt=fmt, png_compression=png_compression, png_strategy=png_strategy,
+    )
 
-                if ok:
-                    writer.writerow([clean_name, out_name, label, ratio])
+    if workers == 1:
+        for path, lv, ch in zip(paths, levels, channels):
+            record(generate(path, lv, ch))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rows in pool.map(generate, paths, levels, channels):
+                record(rows)
 
     print("Stego generation complete.")
     print(f"Log saved to: {log_path}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate random-LSB stego PNGs from the clean dataset.")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="number of worker processes (default: one per CPU, 1 = serial)",
+    )
+    parser.add_argument(
+        "--format", choices=OUTPUT_FORMATS, default="png",
+        help="output container; npy is uncompressed and memory-mappable",
+    )
+    parser.add_argument(
+        "--png-compression", type=int, choices=range(10), default=PNG_COMPRESSION,
+        metavar="0-9", help="zlib level for PNG output (default: OpenCV's)",
+    )
+    parser.add_argument(
+        "--png-strategy", choices=sorted(PNG_STRATEGIES), default="default",
+        help="zlib strategy for PNG output",
+    )
+    args = parser.parse_args()
 
+    main(
+        workers=args.workers,
+        fmt=args.format,
+        png_compression=args.png_compression,
+        png_strategy=args.png_strategy,
+    )
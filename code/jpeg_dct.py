@@ -0,0 +1,461 @@
+import re
+import struct
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+# Frame types whose quantized coefficients we can read: baseline and
+# extended sequential, and progressive (all Huffman coded)
+SEQUENTIAL_SOF = (0xC0, 0xC1)
+PROGRESSIVE_SOF = (0xC2,)
+
+# Any other start-of-frame marker (lossless, arithmetic coding, ...)
+UNSUPPORTED_SOF = (0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+# Largest frame whose coefficients we allocate (64 Mpixels). The header
+# is untrusted input, so a bogus size must not allocate gigabytes
+MAX_FRAME_PIXELS = 1 << 26
+
+# Natural (row-major) position of each zigzag-ordered coefficient
+ZIGZAG = np.array([
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+])
+
+# End of an entropy-coded segment: a marker other than a stuffed byte or RSTn
+SEGMENT_END = re.compile(rb"\xff[^\x00\xd0-\xd7\xff]")
+RESTART = re.compile(rb"\xff[\xd0-\xd7]")
+
+
+# -------------------------------
+# Bit Reading / Huffman Tables
+# -------------------------------
+@lru_cache(maxsize=64)
+def _huffman_lookup(counts, symbols):
+    """
+    Table indexed by the next 16 bits of the stream, giving
+    (code length << 8) | symbol. 0 marks a bit pattern no code starts with.
+    """
+    table = [0] * (1 << 16)
+    code = 0
+    i = 0
+    for length in range(1, 17):
+        for _ in range(counts[length - 1]):
+            lo = code << (16 - length)
+            hi = (code + 1) << (16 - length)
+            table[lo:hi] = [(length << 8) | symbols[i]] * (hi - lo)
+            code += 1
+            i += 1
+        code <<= 1
+    return table
+
+
+def _windows(segment):
+    """
+    24-bit big-endian window starting at every byte of an (unstuffed)
+    segment, so the 16 bits at any bit position p are
+    windows[p >> 3] >> (8 - (p & 7)) & 0xFFFF. Zero-padded past the end.
+    """
+    arr = np.frombuffer(segment + bytes(8), dtype=np.uint8).astype(np.uint32)
+    return ((arr[:-2] << 16) | (arr[1:-1] << 8) | arr[2:]).tolist()
+
+
+def _extend(bits, size):
+    # Map a `size`-bit magnitude category value to its signed value
+    return bits if bits >= 1 << (size - 1) else bits - (1 << size) + 1
+
+
+# -------------------------------
+# Block Decoders
+# -------------------------------
+# Each decodes one block at bit `pos` of `win` into coefs[off:off + 64]
+# (zigzag order) and returns the new bit position.
+
+def _decode_sequential(win, pos, coefs, off, comp, scan):
+    dc_table, ac_table = comp["dc_lookup"], comp["ac_lookup"]
+
+    e = dc_table[win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF]
+    if not e:
+        raise ValueError("Invalid Huffman code in JPEG scan")
+    pos += e >> 8
+    s = e & 0xFF
+    diff = 0
+    if s:
+        diff = _extend((win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF) >> (16 - s), s)
+        pos += s
+    comp["pred"] += diff
+    coefs[off] = comp["pred"]
+
+    k = 1
+    while k < 64:
+        e = ac_table[win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF]
+        if not e:
+            raise ValueError("Invalid Huffman code in JPEG scan")
+        pos += e >> 8
+        rs = e & 0xFF
+        r, s = rs >> 4, rs & 15
+        if s:
+            k += r
+            coefs[off + k] = _extend((win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF) >> (16 - s), s)
+            pos += s
+            k += 1
+        elif r == 15:
+            k += 16
+        else:
+            break
+    return pos
+
+
+def _decode_dc_first(win, pos, coefs, off, comp, scan):
+    e = comp["dc_lookup"][win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF]
+    if not e:
+        raise ValueError("Invalid Huffman code in JPEG scan")
+    pos += e >> 8
+    s = e & 0xFF
+    diff = 0
+    if s:
+        diff = _extend((win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF) >> (16 - s), s)
+        pos += s
+    comp["pred"] += diff
+    coefs[off] = comp["pred"] << scan["al"]
+    return pos
+
+
+def _decode_dc_refine(win, pos, coefs, off, comp, scan):
+    if win[pos >> 3] >> (23 - (pos & 7)) & 1:
+        coefs[off] |= 1 << scan["al"]
+    return pos + 1
+
+
+def _decode_ac_first(win, pos, coefs, off, comp, scan):
+    if scan["eobrun"]:
+        scan["eobrun"] -= 1
+        return pos
+
+    ac_table = comp["ac_lookup"]
+    k, se, al = scan["ss"], scan["se"], scan["al"]
+    while k <= se:
+        e = ac_table[win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF]
+        if not e:
+            raise ValueError("Invalid Huffman code in JPEG scan")
+        pos += e >> 8
+        rs = e & 0xFF
+        r, s = rs >> 4, rs & 15
+        if s:
+            k += r
+            value = _extend((win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF) >> (16 - s), s)
+            coefs[off + k] = value * (1 << al)
+            pos += s
+            k += 1
+        elif r == 15:
+            k += 16
+        else:
+            # End-of-band run covering this block and the next eobrun blocks
+            eobrun = (1 << r) - 1
+            if r:
+                eobrun += (win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF) >> (16 - r)
+                pos += r
+            scan["eobrun"] = eobrun
+            break
+    return pos
+
+
+def _decode_ac_refine(win, pos, coefs, off, comp, scan):
+    ac_table = comp["ac_lookup"]
+    k, se = scan["ss"], scan["se"]
+    p1 = 1 << scan["al"]
+    m1 = -p1
+
+    if not scan["eobrun"]:
+        while k <= se:
+            e = ac_table[win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF]
+            if not e:
+                raise ValueError("Invalid Huffman code in JPEG scan")
+            pos += e >> 8
+            rs = e & 0xFF
+            r, s = rs >> 4, rs & 15
+            if s:
+                # New coefficient of magnitude 1 at this bit position
+                s = p1 if win[pos >> 3] >> (23 - (pos & 7)) & 1 else m1
+                pos += 1
+            elif r != 15:
+                scan["eobrun"] = 1 << r
+                if r:
+                    scan["eobrun"] += (win[pos >> 3] >> (8 - (pos & 7)) & 0xFFFF) >> (16 - r)
+                    pos += r
+                break
+
+            # Skip r zero coefficients, refining the nonzero ones passed over
+            while k <= se:
+                i = off + k
+                if coefs[i]:
+                    if win[pos >> 3] >> (23 - (pos & 7)) & 1 and not coefs[i] & p1:
+                        coefs[i] += p1 if coefs[i] >= 0 else m1
+                    pos += 1
+                else:
+                    if r == 0:
+                        break
+                    r -= 1
+                k += 1
+            if s and k <= se:
+                coefs[off + k] = s
+            k += 1
+
+    if scan["eobrun"]:
+        # Inside an end-of-band run: only correction bits for nonzero coefficients
+        while k <= se:
+            i = off + k
+            if coefs[i]:
+                if win[pos >> 3] >> (23 - (pos & 7)) & 1 and not coefs[i] & p1:
+                    coefs[i] += p1 if coefs[i] >= 0 else m1
+                pos += 1
+            k += 1
+        scan["eobrun"] -= 1
+    return pos
+
+
+# -------------------------------
+# Scans
+# -------------------------------
+def _scan_blocks(frame, comps):
+    """
+    Block offsets of a scan as an (MCUs, blocks per MCU) array, plus the
+    component of each column, in scan order.
+    A single-component scan codes one block per MCU and only the blocks
+    inside the component; interleaved scans follow the MCU layout.
+    """
+    if len(comps) == 1:
+        comp = comps[0]
+        by, bx = np.mgrid[:comp["blocks_h"], :comp["blocks_w"]]
+        offsets = (by * comp["padded_w"] + bx) * 64
+        return offsets.reshape(-1, 1), comps
+
+    my, mx = np.mgrid[:frame["mcus_y"], :frame["mcus_x"]]
+    columns = []
+    owners = []
+    for comp in comps:
+        for v in range(comp["v"]):
+            for h in range(comp["h"]):
+                by = my * comp["v"] + v
+                bx = mx * comp["h"] + h
+                columns.append(((by * comp["padded_w"] + bx) * 64).ravel())
+                owners.append(comp)
+    return np.stack(columns, axis=1), owners
+
+
+def _decode_scan(frame, comps, scan, segments):
+    if not frame["progressive"]:
+        decode = _decode_sequential
+    elif scan["ss"] == 0:
+        decode = _decode_dc_first if scan["ah"] == 0 else _decode_dc_refine
+    else:
+        decode = _decode_ac_first if scan["ah"] == 0 else _decode_ac_refine
+
+    offsets, owners = _scan_blocks(frame, comps)
+    interval = frame["restart_interval"] or len(offsets)
+    units = [(comp, comp["coefs"]) for comp in owners]
+
+    # Each restart interval is its own segment, with predictors reset
+    for i, start in enumerate(range(0, len(offsets), interval)):
+        if i >= len(segments):
+            raise ValueError("JPEG scan ends early")
+        win = _windows(segments[i])
+        pos = 0
+        for comp in comps:
+            comp["pred"] = 0
+        scan["eobrun"] = 0
+
+        for mcu in offsets[start:start + interval].tolist():
+            for (comp, coefs), off in zip(units, mcu):
+                pos = decode(win, pos, coefs, off, comp, scan)
+
+
+def read_dct_coefficients(data):
+    """
+    Quantized DCT coefficients of a JPEG, read straight from its
+    Huffman-coded scans: no dequantization, IDCT or color conversion.
+    Handles baseline, extended sequential and progressive Huffman JPEGs;
+    anything else raises ValueError.
+
+    Returns a dict with the image "width" and "height", "progressive",
+    and "components": one dict per component with its "id", sampling
+    factors "h"/"v", quantization table "quant" (64 values, zigzag
+    order) and "coefs", an int32 array (blocks_h, blocks_w, 64) with
+    every block's coefficients in zigzag order (ZIGZAG maps them to
+    natural order).
+    """
+    data = bytes(data)
+    try:
+        return _read_dct_coefficients(data)
+    except (struct.error, IndexError, KeyError, TypeError, ZeroDivisionError) as e:
+        # Malformed segments the checks below do not name explicitly
+        raise ValueError(f"Corrupt JPEG header: {e!r}") from e
+
+
+def _frame_header(body, marker, file_size):
+    # Parse and validate a start-of-frame segment, before anything is allocated
+    if len(body) < 6 or len(body) < 6 + 3 * body[5]:
+        raise ValueError("Truncated JPEG frame header")
+    height, width = struct.unpack(">HH", body[1:5])
+    if height == 0:
+        raise ValueError("JPEG height defined by DNL is not supported")
+    if width == 0 or body[5] == 0:
+        raise ValueError("JPEG frame has no width or no components")
+    if width * height > MAX_FRAME_PIXELS:
+        raise ValueError(f"JPEG frame of {width}x{height} exceeds {MAX_FRAME_PIXELS} pixels")
+
+    comps = []
+    for c in range(body[5]):
+        cid, hv, tq = body[6 + 3 * c:9 + 3 * c]
+        comp = {"id": cid, "h": hv >> 4, "v": hv & 15, "tq": tq}
+        if not (1 <= comp["h"] <= 4 and 1 <= comp["v"] <= 4):
+            raise ValueError(f"Invalid JPEG sampling factors {comp['h']}x{comp['v']}")
+        comps.append(comp)
+
+    h_max = max(c["h"] for c in comps)
+    v_max = max(c["v"] for c in comps)
+    mcus_x = -(-width // (8 * h_max))
+    mcus_y = -(-height // (8 * v_max))
+    for c in comps:
+        c["blocks_w"] = -(-(-(-width * c["h"] // h_max)) // 8)
+        c["blocks_h"] = -(-(-(-height * c["v"] // v_max)) // 8)
+        c["padded_w"] = mcus_x * c["h"]
+
+    # Every block is Huffman coded at least once (its DC code, one bit or
+    # more), so a real frame cannot hold more blocks than the file has bits
+    n_blocks = sum(c["blocks_w"] * c["blocks_h"] for c in comps)
+    if n_blocks > 8 * file_size:
+        raise ValueError(f"JPEG frame of {width}x{height} does not fit in {file_size} bytes")
+
+    for c in comps:
+        # array("i") rather than a list: same per-item speed, and
+        # numpy can view it without copying every coefficient
+        c["coefs"] = array("i", bytes(4 * mcus_y * c["v"] * c["padded_w"] * 64))
+
+    return {
+        "width": width, "height": height, "comps": comps,
+        "progressive": marker in PROGRESSIVE_SOF,
+        "mcus_x": mcus_x, "mcus_y": mcus_y,
+    }
+
+
+def _scan_header(body, frame):
+    # Parse and validate a start-of-scan segment: (components, scan params)
+    n = body[0] if body else 0
+    if not 1 <= n <= 4 or len(body) < 4 + 2 * n:
+        raise ValueError("Invalid JPEG scan header")
+    by_id = {c["id"]: c for c in frame["comps"]}
+    comps = []
+    for c in range(n):
+        cid = body[1 + 2 * c]
+        if cid not in by_id:
+            raise ValueError(f"JPEG scan names unknown component {cid}")
+        comps.append((by_id[cid], body[2 + 2 * c]))
+    ss, se, a = body[1 + 2 * n:4 + 2 * n]
+    if ss > se or se > 63:
+        raise ValueError(f"Invalid JPEG spectral selection {ss}..{se}")
+    return comps, {"ss": ss, "se": se, "ah": a >> 4, "al": a & 15}
+
+
+def _read_dct_coefficients(data):
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+
+    quant = {}
+    dc_tables = {}
+    ac_tables = {}
+    frame = None
+    restart_interval = 0
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError(f"Expected a JPEG marker at byte {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xD9:
+            break
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        body = data[pos + 4:pos + 2 + length]
+        pos += 2 + length
+
+        if marker == 0xDB:
+            i = 0
+            while i < len(body):
+                precision, table_id = body[i] >> 4, body[i] & 15
+                if precision:
+                    values = struct.unpack(">64H", body[i + 1:i + 129])
+                    i += 129
+                else:
+                    values = tuple(body[i + 1:i + 65])
+                    i += 65
+                quant[table_id] = np.array(values, dtype=np.int32)
+
+        elif marker == 0xC4:
+            i = 0
+            while i < len(body):
+                table_class, table_id = body[i] >> 4, body[i] & 15
+                counts = bytes(body[i + 1:i + 17])
+                symbols = body[i + 17:i + 17 + sum(counts)]
+                i += 17 + sum(counts)
+                tables = ac_tables if table_class else dc_tables
+                tables[table_id] = _huffman_lookup(counts, symbols)
+
+        elif marker == 0xDD:
+            restart_interval = struct.unpack(">H", body[:2])[0]
+
+        elif marker in UNSUPPORTED_SOF:
+            raise ValueError(f"Unsupported JPEG frame type 0x{marker:02X}")
+
+        elif marker in SEQUENTIAL_SOF + PROGRESSIVE_SOF:
+            frame = _frame_header(body, marker, len(data))
+
+        elif marker == 0xDA:
+            if frame is None:
+                raise ValueError("JPEG scan before frame header")
+            scan_comps = []
+            comps, scan = _scan_header(body, frame)
+            for comp, tables in comps:
+                comp["dc_lookup"] = dc_tables.get(tables >> 4)
+                comp["ac_lookup"] = ac_tables.get(tables & 15)
+                scan_comps.append(comp)
+
+            match = SEGMENT_END.search(data, pos)
+            end = match.start() if match else len(data)
+            segments = [
+                s.replace(b"\xff\x00", b"\xff") for s in RESTART.split(data[pos:end])
+            ]
+            frame["restart_interval"] = restart_interval
+            try:
+                _decode_scan(frame, scan_comps, scan, segments)
+            except (IndexError, TypeError) as e:
+                raise ValueError(f"Corrupt or truncated JPEG scan: {e}") from e
+            pos = end
+
+    if frame is None:
+        raise ValueError("JPEG has no frame header")
+
+    components = []
+    for c in frame["comps"]:
+        coefs = np.frombuffer(c["coefs"], dtype=np.int32).reshape(-1, c["padded_w"], 64)
+        components.append({
+            "id": c["id"], "h": c["h"], "v": c["v"],
+            "quant": quant.get(c["tq"]),
+            "coefs": coefs[:c["blocks_h"], :c["blocks_w"]],
+        })
+
+    return {
+        "width": frame["width"],
+        "height": frame["height"],
+        "progressive": frame["progressive"],
+        "components": components,
+    }
@@ -0,0 +1,160 @@
+import io
+import struct
+import zlib
+
+import numpy as np
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# Channels per pixel by PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Compressed bytes inflated at a time while looking for the wanted rows
+INFLATE_CHUNK = 1 << 14
+
+
+def _unfilter(ftype, line, prior, bpp):
+    """Undo one row's PNG filter, given the previous (unfiltered) row."""
+    if ftype == 0:
+        return line
+    if ftype == 1:
+        # Sub: running sum (mod 256) over the pixels, per byte lane
+        return np.cumsum(line.reshape(-1, bpp), axis=0, dtype=np.uint8).ravel()
+    if ftype == 2:
+        return line + prior
+
+    # Average and Paeth depend on the byte just reconstructed, so they
+    # go byte by byte
+    out = bytearray(line.tobytes())
+    up = prior.tolist()
+    if ftype == 3:
+        for i in range(bpp):
+            out[i] = (out[i] + (up[i] >> 1)) & 0xFF
+        for i in range(bpp, len(out)):
+            out[i] = (out[i] + ((out[i - bpp] + up[i]) >> 1)) & 0xFF
+    elif ftype == 4:
+        for i in range(bpp):
+            out[i] = (out[i] + up[i]) & 0xFF
+        for i in range(bpp, len(out)):
+            a, b, c = out[i - bpp], up[i], up[i - bpp]
+            pa = abs(b - c)
+            pb = abs(a - c)
+            pc = abs(a + b - c - c)
+            pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+            out[i] = (out[i] + pred) & 0xFF
+    else:
+        raise ValueError(f"Invalid PNG filter type {ftype}")
+    return np.frombuffer(bytes(out), dtype=np.uint8)
+
+
+def read_png_rows(source, min_pixels):
+    """
+    Decode only the first rows of a PNG, enough to hold min_pixels
+    pixels: chunks are read and inflated just until those rows are
+    complete, and only they are unfiltered.
+    `source` is a path or the encoded bytes. Returns (rows, io_stats):
+    rows is a BGR uint8 array (rows, width, 3), as load_image would give
+    for the same rows, and io_stats holds "bytes_read" (bytes of the
+    file read), "bytes_decoded" (pixel bytes produced) and "bytes_full"
+    (pixel bytes of a full decode).
+    Interlaced images and grayscale below 8 bits raise ValueError, as do
+    corrupt ones (bad header, image data or palette index), so callers
+    can fall back to a full decode.
+    """
+    f = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else open(source, "rb")
+    with f:
+        if f.read(len(PNG_MAGIC)) != PNG_MAGIC:
+            raise ValueError("Not a PNG file")
+        bytes_read = len(PNG_MAGIC)
+
+        header = None
+        palette = None
+        inflater = zlib.decompressobj()
+        raw = bytearray()
+        needed = None
+
+        while needed is None or len(raw) < needed:
+            chunk_head = f.read(8)
+            bytes_read += len(chunk_head)
+            if len(chunk_head) < 8:
+                raise ValueError("PNG ends before the wanted rows")
+            length, kind = struct.unpack(">I4s", chunk_head)
+
+            if kind != b"IDAT":
+                data = f.read(length + 4)
+                bytes_read += len(data)
+                if kind == b"IHDR":
+                    if len(data) < 13:
+                        raise ValueError("Truncated PNG header")
+                    header = struct.unpack(">IIBBBBB", data[:13])
+                    width, height, depth, color, _, _, interlace = header
+                    if not width or not height:
+                        raise ValueError("PNG has no pixels")
+                    if interlace:
+                        raise ValueError("Interlaced PNGs are not supported")
+                    if color not in PNG_CHANNELS or (depth < 8 and color != 3):
+                        raise ValueError(f"Unsupported PNG format (color {color}, depth {depth})")
+                    channels = PNG_CHANNELS[color]
+                    bpp = max(1, channels * depth // 8)
+                    row_bytes = -(-width * channels * depth // 8)
+                    n_rows = min(height, -(-min_pixels // width))
+                    needed = n_rows * (row_bytes + 1)
+                elif kind == b"PLTE":
+                    palette = np.frombuffer(data[:length], dtype=np.uint8).reshape(-1, 3)
+                elif kind == b"IEND":
+                    raise ValueError("PNG ends before the wanted rows")
+                continue
+
+            if header is None:
+                raise ValueError("PNG image data before header")
+
+            # Inflate this IDAT piece by piece, stopping as soon as the
+            # wanted rows are complete
+            remaining = length
+            while remaining and len(raw) < needed:
+                data = f.read(min(INFLATE_CHUNK, remaining))
+                if not data:
+                    raise ValueError("PNG ends before the wanted rows")
+                remaining -= len(data)
+                bytes_read += len(data)
+                try:
+                    raw += inflater.decompress(data, needed - len(raw))
+                    while inflater.unconsumed_tail and len(raw) < needed:
+                        raw += inflater.decompress(inflater.unconsumed_tail, needed - len(raw))
+                except zlib.error as e:
+                    raise ValueError(f"Corrupt PNG image data: {e}") from e
+            if not remaining:
+                bytes_read += len(f.read(4))  # CRC
+
+    # Unfilter row by row
+    lines = np.frombuffer(bytes(raw[:needed]), dtype=np.uint8).reshape(n_rows, row_bytes + 1)
+    prior = np.zeros(row_bytes, dtype=np.uint8)
+    rows = np.empty((n_rows, row_bytes), dtype=np.uint8)
+    for r in range(n_rows):
+        prior = _unfilter(int(lines[r, 0]), lines[r, 1:], prior, bpp)
+        rows[r] = prior
+
+    # To BGR uint8, as cv2.IMREAD_COLOR would decode it
+    if color == 3:
+        if depth < 8:
+            bits = np.unpackbits(rows, axis=1).reshape(n_rows, -1, depth)[:, :width]
+            index = (bits * (1 << np.arange(depth - 1, -1, -1))).sum(axis=2)
+        else:
+            index = rows
+        if palette is None:
+            raise ValueError("Palette PNG without a PLTE chunk")
+        if index.size and int(index.max()) >= len(palette):
+            raise ValueError("PNG palette index beyond the PLTE entries")
+        pixels = palette[index][..., ::-1]
+    else:
+        pixels = rows.reshape(n_rows, width, channels, depth // 8)[..., 0]  # 16-bit: high byte
+        if channels <= 2:
+            pixels = np.repeat(pixels[..., :1], 3, axis=2)
+        else:
+            pixels = pixels[..., 2::-1]
+
+    return np.ascontiguousarray(pixels), {
+        "bytes_read": bytes_read,
+        "bytes_decoded": int(pixels.nbytes),
+        "bytes_full": int(width * height * 3),
+    }
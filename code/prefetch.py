@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Items loaded ahead of the consumer (loading, or loaded and waiting)
+PREFETCH_DEPTH = 64
+
+# No new load starts while loaded, unconsumed results hold more than this
+PREFETCH_MAX_BYTES = 256 << 20
+
+# Loader threads; file reads and cv2 decodes release the GIL, so they
+# run alongside the analysis in the main thread. Mostly waiting on
+# storage, so more than the CPU count: several reads stay in flight
+LOADER_THREADS = (os.cpu_count() or 1) + 3
+
+
+def _nbytes(result):
+    if hasattr(result, "nbytes"):
+        return int(result.nbytes)
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return len(result)
+    return 0
+
+
+class PrefetchLoader:
+    """
+    Runs `load` (e.g. detect_lsb.load_image) over a list of items in
+    background threads, ahead of the consumer, so reading and decoding
+    the next images overlaps with analyzing the current ones.
+
+    Iterating yields (item, load(item)) in item order. At most `depth`
+    items are in flight, and no new load is started while the items in
+    flight hold more than max_bytes: loaded results count their size,
+    loads still running the largest size seen so far. One item is always
+    allowed, so a single huge image still gets through. The window is
+    topped up both when the consumer takes an item and when a load
+    finishes. An exception raised by `load` is re-raised when its item
+    is reached.
+
+    `stats` counts the items loaded and how long the consumer sat
+    waiting for a load to finish ("wait_s"): near zero means loading
+    kept up with the analysis, a large share of the run means I/O bound.
+    """
+
+    def __init__(self, items, load, depth=PREFETCH_DEPTH,
+                 max_bytes=PREFETCH_MAX_BYTES, threads=LOADER_THREADS):
+        self.items = list(items)
+        self.load = load
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        self.threads = max(1, threads)
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="prefetch")
+        self.stats = {"loaded": 0, "waits": 0, "wait_s": 0.0}
+
+        # Shared with the load callbacks, guarded by the lock
+        self.lock = threading.RLock()
+        self.window = deque()
+        self.next_item = 0
+        self.largest = 0
+        self.closed = False
+
+    def _held_bytes(self):
+        held = 0
+        for _, future in self.window:
+            if not future.done():
+                held += self.largest
+            elif future.exception() is None:
+                held += _nbytes(future.result())
+        return held
+
+    def _has_room(self):
+        if not self.window:
+            return True
+        if len(self.window) >= self.depth:
+            return False
+        if not self.largest:
+            # No load finished yet, so no size to go by: just keep the
+            # threads busy
+            return len(self.window) < self.threads
+        return self._held_bytes() < self.max_bytes
+
+    def _fill(self, _=None):
+        with self.lock:
+            while not self.closed and self.next_item < len(self.items) and self._has_room():
+                item = self.items[self.next_item]
+                self.next_item += 1
+                future = self.pool.submit(self._load, item)
+                self.window.append((item, future))
+                future.add_done_callback(self._fill)
+
+    def _load(self, item):
+        result = self.load(item)
+        with self.lock:
+            self.largest = max(self.largest, _nbytes(result))
+        return result
+
+    def __iter__(self):
+        while True:
+            self._fill()
+            with self.lock:
+                if not self.window:
+                    return
+                item, future = self.window[0]
+
+            if not future.done():
+                start = time.perf_counter()
+                future.exception()  # wait, without raising yet
+                self.stats["waits"] += 1
+                self.stats["wait_s"] += time.perf_counter() - start
+
+            with self.lock:
+                self.window.popleft()
+            self.stats["loaded"] += 1
+            yield item, future.result()
+
+    def close(self):
+        # Loads not started yet are cancelled (what shutdown's
+        # cancel_futures does, which needs Python 3.9)
+        with self.lock:
+            self.closed = True
+            futures = [future for _, future in self.window]
+        for future in futures:
+            future.cancel()
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
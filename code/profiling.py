@@ -0,0 +1,369 @@
+import cProfile
+import heapq
+import itertools
+import json
+import marshal
+import os
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+
+PROJECT = Path(__file__).resolve().parents[1]
+
+# Profiled runs write their counters (and slowest-image profiles) here
+PROFILE_DIR = PROJECT / "results" / "profile"
+
+# Set to "json" (or "1") or "prom" to profile any run in that export format;
+# the --profile flag of run_analysis.py sets it too, so workers follow along
+PROFILE_ENV = "STEGO_PROFILE"
+
+# Number of slowest images to keep cProfile dumps of (0 = none)
+PROFILE_TOP_ENV = "STEGO_PROFILE_TOP"
+
+PROFILE_FORMATS = ("json", "prom")
+
+# Upper bounds (seconds) of the per-call duration histogram buckets
+DURATION_BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0, 10.0)
+
+# Prefix of the exported Prometheus metric names
+METRIC_PREFIX = "stego_stage"
+
+
+def _nbytes(value):
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return 0
+
+
+def _new_counters():
+    return {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "bytes": 0,
+            "buckets": [0] * (len(DURATION_BUCKETS) + 1)}
+
+
+class _Stage:
+    # One timed stage; set .nbytes inside the block if not known up front
+    __slots__ = ("profiler", "name", "nbytes", "wall", "cpu")
+
+    def __init__(self, profiler, name, nbytes):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(
+            self.name, time.perf_counter() - self.wall, time.thread_time() - self.cpu, self.nbytes
+        )
+
+
+class _NullStage:
+    # What stage() hands out while profiling is off. It is shared, so it
+    # holds no state: setting .nbytes is accepted and ignored
+    __slots__ = ()
+
+    @property
+    def nbytes(self):
+        return 0
+
+    @nbytes.setter
+    def nbytes(self, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """
+    Per-stage counters for one process: calls, wall time, CPU time (of
+    the thread that ran the stage, so stages in loader threads count
+    their own), bytes processed and a histogram of call durations.
+    Stages may nest (e.g. analyze_batch holds the detector stages run
+    inside it), so their times are not meant to add up.
+
+    With top > 0, call() also runs the function under cProfile and keeps
+    the profiles of the `top` slowest calls. Counters and profiles are
+    plain data: take() hands them over (e.g. from a worker process) and
+    merge() adds them to another profiler.
+    """
+
+    def __init__(self, fmt="json", top=0):
+        if fmt not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format {fmt!r}, expected one of {PROFILE_FORMATS}")
+        self.fmt = fmt
+        self.top = max(0, top)
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.slowest = []  # min-heap of (wall_s, seq, key, pstats data)
+        self.seq = itertools.count()
+
+    def stage(self, name, nbytes=0):
+        return _Stage(self, name, nbytes)
+
+    def record(self, name, wall, cpu, nbytes=0):
+        bucket = sum(wall > bound for bound in DURATION_BUCKETS)
+        with self.lock:
+            counters = self.stages.get(name)
+            if counters is None:
+                counters = self.stages[name] = _new_counters()
+            counters["calls"] += 1
+            counters["wall_s"] += wall
+            counters["cpu_s"] += cpu
+            counters["bytes"] += nbytes
+            counters["buckets"][bucket] += 1
+
+    def call(self, name, key, func, *args, **kwargs):
+        """
+        func(*args, **kwargs) timed as stage `name`; with top > 0 it is
+        also cProfiled, and the profile kept under `key` if the call is
+        among the slowest so far.
+        """
+        if not self.top:
+            with self.stage(name):
+                return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        with self.stage(name) as timed:
+            result = profile.runcall(func, *args, **kwargs)
+        wall = time.perf_counter() - timed.wall
+        profile.create_stats()
+        self._keep(wall, key, profile.stats)
+        return result
+
+    def _keep(self, wall, key, stats):
+        with self.lock:
+            heapq.heappush(self.slowest, (wall, next(self.seq), key, stats))
+            if len(self.slowest) > self.top:
+                heapq.heappop(self.slowest)
+
+    def take(self):
+        """Counters and kept profiles so far, resetting them."""
+        with self.lock:
+            taken = {
+                "stages": self.stages,
+                "slowest": [(wall, key, stats) for wall, _, key, stats in self.slowest],
+            }
+            self.stages = {}
+            self.slowest = []
+        return taken
+
+    def merge(self, taken):
+        with self.lock:
+            for name, other in taken["stages"].items():
+                counters = self.stages.setdefault(name, _new_counters())
+                for field in ("calls", "wall_s", "cpu_s", "bytes"):
+                    counters[field] += other[field]
+                counters["buckets"] = [a + b for a, b in zip(counters["buckets"], other["buckets"])]
+        for wall, key, stats in taken["slowest"]:
+            self._keep(wall, key, stats)
+
+    def reset(self):
+        self.take()
+
+    def ranked(self):
+        """(name, counters) of every stage, most wall time first."""
+        with self.lock:
+            return sorted(self.stages.items(), key=lambda item: -item[1]["wall_s"])
+
+    def to_json(self):
+        stages = {}
+        for name, c in self.ranked():
+            stages[name] = {
+                "calls": c["calls"],
+                "wall_s": c["wall_s"],
+                "cpu_s": c["cpu_s"],
+                "bytes": c["bytes"],
+                "mean_ms": 1e3 * c["wall_s"] / max(c["calls"], 1),
+                "mb_per_s": c["bytes"] / 1e6 / c["wall_s"] if c["wall_s"] > 0 else None,
+                "histogram": {"le": list(DURATION_BUCKETS) + ["+Inf"], "counts": c["buckets"]},
+            }
+        return stages
+
+    def to_prometheus(self):
+        """Counters in the Prometheus text exposition format."""
+        ranked = self.ranked()
+        lines = []
+        for metric, field, help_text in (
+            ("calls_total", "calls", "Times each stage ran"),
+            ("seconds_total", "wall_s", "Wall time spent in each stage"),
+            ("cpu_seconds_total", "cpu_s", "CPU time spent in each stage"),
+            ("bytes_total", "bytes", "Bytes processed by each stage"),
+        ):
+            lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} counter")
+            for name, c in ranked:
+                lines.append(f'{METRIC_PREFIX}_{metric}{{stage="{name}"}} {c[field]}')
+
+        metric = f"{METRIC_PREFIX}_duration_seconds"
+        lines.append(f"# HELP {metric} Duration of each stage call")
+        lines.append(f"# TYPE {metric} histogram")
+        for name, c in ranked:
+            # Prometheus buckets are cumulative
+            for bound, count in zip(list(DURATION_BUCKETS) + ["+Inf"], itertools.accumulate(c["buckets"])):
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {c["wall_s"]}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {c["calls"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump_slowest(self, directory):
+        """
+        Write the kept profiles, slowest first, as cProfile dumps
+        (<rank>_<key>.prof, readable with pstats, snakeviz, gprof2dot...).
+        Returns [(key, wall_s, path)].
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for old in directory.glob("*.prof"):
+            old.unlink()
+
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+        written = []
+        for rank, (wall, _, key, stats) in enumerate(slowest, 1):
+            path = directory / f"{rank:02d}_{key}.prof"
+            with open(path, "wb") as f:
+                marshal.dump(stats, f)
+            written.append((key, wall, path))
+        return written
+
+
+# -------------------------------
+# Process-Wide Profiler
+# -------------------------------
+
+# None unless profiling is on (STEGO_PROFILE, or enable())
+PROFILER = None
+
+
+def enable(fmt=None, top=None):
+    """
+    Turn profiling on for this process and, through the environment,
+    for the worker processes it starts. A format or top left as None
+    keeps the current setting (json and 0 by default).
+    """
+    global PROFILER
+    if fmt is None:
+        fmt = PROFILER.fmt if PROFILER is not None else "json"
+    if top is None:
+        top = PROFILER.top if PROFILER is not None else 0
+    PROFILER = Profiler(fmt, top)
+    os.environ[PROFILE_ENV] = fmt
+    os.environ[PROFILE_TOP_ENV] = str(top)
+    return PROFILER
+
+
+def _enable_from_env():
+    fmt = os.environ.get(PROFILE_ENV, "").strip().lower()
+    if fmt in ("", "0"):
+        return
+    enable("json" if fmt == "1" else fmt, int(os.environ.get(PROFILE_TOP_ENV) or 0))
+
+
+def enabled():
+    return PROFILER is not None
+
+
+def slowest_count():
+    """Number of slowest calls being cProfiled (0 when not profiling)."""
+    return PROFILER.top if PROFILER is not None else 0
+
+
+def stage(name, nbytes=0):
+    """
+    Context manager timing a block as stage `name` (a no-op unless
+    profiling is on). nbytes, or .nbytes set inside the block, is added
+    to the stage's bytes processed.
+    """
+    if PROFILER is None:
+        return _NULL_STAGE
+    return PROFILER.stage(name, nbytes)
+
+
+def timed(name):
+    """Decorator timing every call as stage `name`, counting the bytes of the first argument."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if PROFILER is None:
+                return func(*args, **kwargs)
+            with PROFILER.stage(name, _nbytes(args[0]) if args else 0):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def call(name, key, func, *args, **kwargs):
+    """Profiler.call on the process profiler, or just func(...) when off."""
+    if PROFILER is None:
+        return func(*args, **kwargs)
+    return PROFILER.call(name, key, func, *args, **kwargs)
+
+
+def take():
+    return PROFILER.take() if PROFILER is not None else None
+
+
+def merge(taken):
+    if PROFILER is not None and taken is not None:
+        PROFILER.merge(taken)
+
+
+def reset():
+    # Worker initializer: drop counters inherited from the parent on fork
+    if PROFILER is not None:
+        PROFILER.reset()
+
+
+def print_profile(profiler):
+    print("\n=== Profile ===")
+    print(f"{'stage':30s} {'calls':>8s} {'wall s':>9s} {'cpu s':>9s} {'mean ms':>9s} {'MB':>10s} {'MB/s':>9s}")
+    for name, c in profiler.ranked():
+        mean_ms = 1e3 * c["wall_s"] / max(c["calls"], 1)
+        rate = f"{c['bytes'] / 1e6 / c['wall_s']:9.1f}" if c["bytes"] and c["wall_s"] > 0 else f"{'-':>9s}"
+        print(f"{name:30s} {c['calls']:8d} {c['wall_s']:9.3f} {c['cpu_s']:9.3f} "
+              f"{mean_ms:9.3f} {c['bytes'] / 1e6:10.2f} {rate}")
+
+
+def finish(run_name, directory=PROFILE_DIR):
+    """
+    End of a profiled run: print the stage table and export the counters
+    to <directory>/<run_name>.json (or .prom), plus the slowest calls'
+    cProfile dumps under <run_name>_slowest/. Does nothing when off.
+    """
+    if PROFILER is None:
+        return
+
+    print_profile(PROFILER)
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if PROFILER.fmt == "prom":
+        path = directory / f"{run_name}.prom"
+        path.write_text(PROFILER.to_prometheus())
+    else:
+        path = directory / f"{run_name}.json"
+        with open(path, "w") as f:
+            json.dump({"run": run_name, "created": time.time(), "stages": PROFILER.to_json()}, f, indent=2)
+    print("\nProfile written →", path)
+
+    if PROFILER.top:
+        written = PROFILER.dump_slowest(directory / f"{run_name}_slowest")
+        print(f"\nSlowest {len(written)} (cProfile dumps, e.g. python -m pstats <file>):")
+        for key, wall, dump in written:
+            print(f"  {wall * 1e3:9.1f} ms  {key}  → {dump.name}")
+
+
+_enable_from_env()
@@ -1,15 +1,43 @@
+import argparse
 import csv
-import statistics
-from collections import defaultdict
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import chain, islice
 from pathlib import Path
 import re
-import math
 
+import numpy as np
+
+import profiling
 from detect_lsb import (
-    extract_lsb,
-    chi_square_test,
-    rs_analysis,
-    sample_pair_stat,
+    DETECTOR_VERSION,
+    MAX_BITS,
+    load_image,
+    analyze_batch,
+    analyze_image,
+    analyze_jpeg,
+    is_jpeg,
+    raw_suspicious_score,
+    build_baseline_profile,
+    save_baseline_profile,
+)
+from corpus import CorpusManifest
+from prefetch import PREFETCH_DEPTH, PREFETCH_MAX_BYTES, PrefetchLoader
+from feature_cache import FeatureCache, fingerprint
+from feature_store import (
+    CLEAN,
+    FEATURE_COLUMNS,
+    LABELS,
+    RawFeatureLog,
+    build_table,
+    counts_at_or_above,
+    group_mean_std,
+    label_counts,
+    load_raw_table,
+    write_csv,
 )
 
 PROJECT = Path(__file__).resolve().parents[1]
@@ -17,40 +45,175 @@ PROJECT = Path(__file__).resolve().parents[1]
 CLEAN_DIR = PROJECT / "dataset" / "clean"
 STEGO_DIR = PROJECT / "dataset" / "stego"
 OUTPUT_CSV = PROJECT / "results" / "analysis_results.csv"
+RESULTS_NPY = PROJECT / "results" / "analysis_results.npy"
+RAW_CSV = PROJECT / "results" / "raw_features.csv"
+ROC_CSV = PROJECT / "results" / "roc_sweep.csv"
+ROC_AUC_JSON = PROJECT / "results" / "roc_auc.json"
+CACHE_DB = PROJECT / "results" / "feature_cache.sqlite"
+MANIFEST_DB = PROJECT / "results" / "corpus_manifest.sqlite"
+
+# False-positive rates to report operating points for in the ROC summary
+TARGET_FPRS = (0.0, 0.01, 0.05, 0.1)
+
+# Which pixels each image contributes (see detect_lsb.BIT_BUDGETS):
+# "prefix" keeps the original first-MAX_BITS behavior, "full" scans everything
+BIT_BUDGET = "prefix"
+
+# How JPEG files are analyzed: "dct" reads their quantized DCT coefficients
+# (detect_lsb.analyze_jpeg), "pixel" decodes them like any other image
+JPEG_DOMAIN = "dct"
+
+# Detector parameters (also part of the feature cache fingerprint)
+BLOCK_SIZE = 32   # bits per chi-square block
+GROUP_SIZE = 4    # pixels per RS group
+CHANNEL = 0       # blue, the only channel the detectors read
+
+# With --stream, raw features are appended to RAW_CSV this many images at a time
+STREAM_BATCH = 256
+
+# Images analyzed together by one detect_lsb.analyze_batch call (when
+# running serially; with workers each gets smaller batches by default)
+ANALYSIS_BATCH = 32
+
+
+def feature_fingerprint(budget=BIT_BUDGET, jpeg_domain=None):
+    return fingerprint({
+        "detector_version": DETECTOR_VERSION,
+        "budget": budget,
+        "jpeg_domain": jpeg_domain or JPEG_DOMAIN,
+        "max_bits": MAX_BITS,
+        "block_size": BLOCK_SIZE,
+        "group_size": GROUP_SIZE,
+        "channel": CHANNEL,
+    })
+
+
+def analyze_dct(image, budget=BIT_BUDGET):
+    # JPEGs (path or file bytes) are analyzed on their quantized DCT
+    # coefficients, without a pixel decode; None for other files and for
+    # JPEG variants jpeg_dct cannot read (those fall back to pixels)
+    if JPEG_DOMAIN == "dct" and is_jpeg(image):
+        try:
+            return analyze_jpeg(image, budget=budget, block_size=BLOCK_SIZE)
+        except ValueError:
+            pass
+    return None
+
+
+def load_input(image_path):
+    """
+    Everything process_batch needs from disk for one image, in a form
+    that can be produced in a loader thread: the file bytes of a JPEG
+    analyzed in the DCT domain (its pure-Python decode runs with the
+    analysis), the decoded pixels of anything else.
+    """
+    if JPEG_DOMAIN == "dct" and is_jpeg(image_path):
+        return Path(image_path).read_bytes()
+    return load_image(image_path)
+
 
+def try_load_input(image_path):
+    # load_input, or the ValueError of an image that cannot be read (e.g.
+    # a truncated file) for process_batch to report and skip
+    try:
+        return load_input(image_path)
+    except ValueError as err:
+        return err
 
-def process_image(image_path, label):
-    # Extract LSBs for chi-square and sample-pair
-    lsbs = extract_lsb(str(image_path))
 
-    # Chi-square statistics (block-based + bias)
-    # chi_square_test is expected to return:
-    #   chi_mean, chi_std, chi_frac_sig, chi_bias
-    chi_mean, chi_std, chi_frac_sig, chi_bias = chi_square_test(lsbs)
+def analyze_file(image_path, budget=BIT_BUDGET):
+    features = analyze_dct(image_path, budget=budget)
+    if features is not None:
+        return features
 
-    # Multi-mask RS analysis (expected to return RS_mean, RS_std)
-    RS_mean, RS_std = rs_analysis(str(image_path))
+    # Decode once; every detector below works on the same pixel buffer
+    img = load_image(image_path)
 
-    # Sample-pair statistics
-    sp_ratio, sp_dev = sample_pair_stat(lsbs)
+    # Chi-square (block-based + bias), multi-mask RS and sample-pair
+    # statistics, accumulated strip by strip over the budgeted pixels
+    return analyze_image(
+        img, budget=budget, block_size=BLOCK_SIZE, group_size=GROUP_SIZE
+    )
+
+
+def process_image(image_path, label, budget=BIT_BUDGET):
+    features = analyze_file(image_path, budget=budget)
 
     return {
         "filename": image_path.name,   # just the file name, used for matching
         "label": label,                # "clean", "5percent", "10percent", "25percent"
-        "chi_mean": chi_mean,
-        "chi_std": chi_std,
-        "chi_frac_p_lt_0_05": chi_frac_sig,
-        "chi_bias": chi_bias,
-        "RS_mean": RS_mean,
-        "RS_std": RS_std,
-        "SP_equal_ratio": sp_ratio,
-        "SP_dev_from_0_5": sp_dev,
+        **features,
         # will fill in later:
         # "suspicious_score": ...
         # "susp_z": ...
     }
 
 
+def process_batch(image_paths, labels, budget=BIT_BUDGET, inputs=None):
+    """
+    process_image over several images: every image analyzed in the pixel
+    domain is decoded, then all of them go through one analyze_batch
+    call; JPEGs analyzed in the DCT domain are handled one by one.
+    `inputs` are the images' try_load_input results when already loaded
+    (e.g. by a PrefetchLoader); otherwise they are loaded here.
+    Images that cannot be read are reported and get None instead of a row.
+    """
+    if inputs is None:
+        inputs = [try_load_input(path) for path in image_paths]
+    features = [None] * len(image_paths)
+    pixels = {}
+    for i, (path, data) in enumerate(zip(image_paths, inputs)):
+        if isinstance(data, bytes):
+            features[i] = analyze_dct(data, budget=budget)
+            if features[i] is not None:
+                continue
+            # A JPEG jpeg_dct cannot read: decode its pixels instead
+            try:
+                data = load_image(data)
+            except ValueError as err:
+                data = err
+        if isinstance(data, ValueError):
+            print(f"Skipping {path}: {data}", flush=True)
+            continue
+        pixels[i] = data
+
+    if pixels:
+        batch = analyze_batch(
+            list(pixels.values()),
+            budget=budget, block_size=BLOCK_SIZE, group_size=GROUP_SIZE,
+        )
+        for j, i in enumerate(pixels):
+            # Back to process_image's plain floats, with None where undefined
+            features[i] = {c: None if np.isnan(v[j]) else float(v[j]) for c, v in batch.items()}
+
+    return [
+        None if f is None else {"filename": path.name, "label": label, **f}
+        for path, label, f in zip(image_paths, labels, features)
+    ]
+
+
+def process_batch_profiled(image_paths, labels, budget=BIT_BUDGET, inputs=None):
+    """
+    process_batch in a profiled run (see profiling.py): the batch is
+    timed as the "analyze_batch" stage, and cProfiled to keep the
+    slowest ones with --profile-top. Returns (rows, counters), the
+    counters being those this process gathered since the last call, so
+    workers can send them back along with their rows.
+    """
+    key = image_paths[0].name if len(image_paths) == 1 else f"{image_paths[0].name}+{len(image_paths) - 1}"
+    rows = profiling.call(
+        "analyze_batch", key, process_batch, image_paths, labels, budget=budget, inputs=inputs
+    )
+    return rows, profiling.take()
+
+
+def merge_profiled(results):
+    # Rows of process_batch_profiled results, merging each batch's counters
+    for rows, counters in results:
+        profiling.merge(counters)
+        yield rows
+
+
 def get_base_name(fname: str) -> str:
     """
     Extract base filename:
@@ -64,40 +227,44 @@ def get_base_name(fname: str) -> str:
     return stem
 
 
-def summarize_by_label(rows):
-    labels = sorted({row["label"] for row in rows})
-    metrics = ["chi_mean", "RS_mean", "SP_equal_ratio", "SP_dev_from_0_5", "suspicious_score"]
+def summarize_by_label(table):
+    counts = label_counts(table)
+    present = sorted(LABELS[code] for code in np.flatnonzero(counts))
+    metrics = ["chi_mean", "RS_mean", "SP_equal_ratio", "SP_dev_from_0_5", "SPA_rate", "suspicious_score"]
+    means = {m: group_mean_std(table, m)[1] for m in metrics}
 
     print("\n=== Per-label summary (means) ===")
-    for label in labels:
-        subset = [r for r in rows if r["label"] == label]
-        print(f"\nLabel: {label}  (n={len(subset)})")
+    for label in present:
+        code = LABELS.index(label)
+        print(f"\nLabel: {label}  (n={counts[code]})")
         for m in metrics:
-            values = [r[m] for r in subset]
-            mean_val = statistics.mean(values) if values else float("nan")
-            print(f"  {m:18s}: {mean_val:.4f}")
+            print(f"  {m:18s}: {means[m][code]:.4f}")
 
 
-def summarize_detection(rows, thresholds=(0.05, 0.1, 0.2)):
-    clean = [r for r in rows if r["label"] == "clean"]
-    stego = [r for r in rows if r["label"] != "clean"]
+def summarize_detection(table, thresholds=(0.05, 0.1, 0.2)):
+    counts = label_counts(table)
+    n_clean = int(counts[CLEAN])
+    n_stego = int(counts.sum() - n_clean)
 
-    if not clean or not stego:
+    if not n_clean or not n_stego:
         print("\n[Detection summary] Not enough data to compute (need both clean and stego).")
         return
 
     print("\n=== Detection performance (using suspicious_score) ===")
-    print(f"Total clean images: {len(clean)}")
-    print(f"Total stego images: {len(stego)}")
+    print(f"Total clean images: {n_clean}")
+    print(f"Total stego images: {n_stego}")
+
+    above = counts_at_or_above(table, "suspicious_score", thresholds)
+    stego_above = above.sum(axis=0) - above[CLEAN]
 
-    for thresh in thresholds:
-        tp = sum(r["suspicious_score"] >= thresh for r in stego)
-        fn = len(stego) - tp
-        fp = sum(r["suspicious_score"] >= thresh for r in clean)
-        tn = len(clean) - fp
+    for i, thresh in enumerate(thresholds):
+        tp = int(stego_above[i])
+        fn = n_stego - tp
+        fp = int(above[CLEAN, i])
+        tn = n_clean - fp
 
-        tpr = tp / len(stego) if stego else 0.0
-        fpr = fp / len(clean) if clean else 0.0
+        tpr = tp / n_stego
+        fpr = fp / n_clean
 
         print(f"\nThreshold = {thresh:.2f}")
         print(f"  TPR (recall on stego): {tpr:.3f}")
@@ -105,66 +272,67 @@ def summarize_detection(rows, thresholds=(0.05, 0.1, 0.2)):
         print(f"  TP={tp}, FN={fn}, FP={fp}, TN={tn}")
 
 
-def summarize_detection_per_payload(rows, thresholds=(0.05, 0.1, 0.2)):
-    clean = [r for r in rows if r["label"] == "clean"]
+def summarize_detection_per_payload(table, thresholds=(0.05, 0.1, 0.2)):
+    counts = label_counts(table)
+    n_clean = int(counts[CLEAN])
     payload_labels = ["5percent", "10percent", "25percent"]
 
-    if not clean:
+    if not n_clean:
         print("\n[Per-payload detection] No clean images found; cannot compute FPR.")
         return
 
     print("\n=== Detection by payload level (using suspicious_score) ===")
-    print(f"Total clean images: {len(clean)}")
+    print(f"Total clean images: {n_clean}")
     for pl in payload_labels:
-        count_pl = sum(r["label"] == pl for r in rows)
-        print(f"Total {pl} images: {count_pl}")
+        print(f"Total {pl} images: {counts[LABELS.index(pl)]}")
 
-    for thresh in thresholds:
+    above = counts_at_or_above(table, "suspicious_score", thresholds)
+
+    for i, thresh in enumerate(thresholds):
         print(f"\nThreshold = {thresh:.2f}")
 
         # False positives on clean (same for all payloads at this threshold)
-        fp = sum(r["suspicious_score"] >= thresh for r in clean)
-        fpr = fp / len(clean) if len(clean) else 0.0
-        print(f"  Clean false-positive rate: {fpr:.3f} (FP={fp}/{len(clean)})")
+        fp = int(above[CLEAN, i])
+        fpr = fp / n_clean
+        print(f"  Clean false-positive rate: {fpr:.3f} (FP={fp}/{n_clean})")
 
         # Per-payload true positive rate
         for pl in payload_labels:
-            subset = [r for r in rows if r["label"] == pl]
-            if not subset:
+            code = LABELS.index(pl)
+            n = int(counts[code])
+            if not n:
                 continue
-            tp = sum(r["suspicious_score"] >= thresh for r in subset)
-            fn = len(subset) - tp
-            tpr = tp / len(subset) if subset else 0.0
+            tp = int(above[code, i])
+            fn = n - tp
+            tpr = tp / n
             print(
                 f"  Payload {pl:9s}: TPR={tpr:.3f} "
-                f"(TP={tp}/{len(subset)}, FN={fn})"
+                f"(TP={tp}/{n}, FN={fn})"
             )
 
 
 # --- Confidence interval helpers ---
 
-def mean_ci(values, confidence=0.95):
-    n = len(values)
-    mean = statistics.mean(values)
-    std = statistics.pstdev(values)
+def mean_ci(mean, std, n, confidence=0.95):
     z = 1.96  # 95%
-    margin = z * std / math.sqrt(n)
+    margin = z * std / np.sqrt(n)
     return mean, mean - margin, mean + margin
 
 
-def summarize_confidence_intervals(rows):
+def summarize_confidence_intervals(table):
     labels = ["clean", "5percent", "10percent", "25percent"]
-    metrics = ["suspicious_score", "chi_mean", "RS_mean", "SP_equal_ratio", "SP_dev_from_0_5"]
+    metrics = ["suspicious_score", "chi_mean", "RS_mean", "SP_equal_ratio", "SP_dev_from_0_5", "SPA_rate"]
+    stats = {m: group_mean_std(table, m) for m in metrics}
 
     print("\n=== 95% Confidence Intervals by Label ===")
 
     for label in labels:
-        subset = [r for r in rows if r["label"] == label]
-        print(f"\nLabel: {label} (n={len(subset)})")
+        code = LABELS.index(label)
+        print(f"\nLabel: {label} (n={label_counts(table)[code]})")
 
         for m in metrics:
-            vals = [r[m] for r in subset]
-            mean, lower, upper = mean_ci(vals)
+            counts, means, stds = stats[m]
+            mean, lower, upper = mean_ci(means[code], stds[code], counts[code])
             print(f"  {m:18s}: mean={mean:.4f}, CI=({lower:.4f}, {upper:.4f})")
 
 
@@ -174,149 +342,541 @@ def ci_wilson(successes, total, z=1.96):
     p = successes / total
     denom = 1 + (z**2 / total)
     center = p + (z**2 / (2 * total))
-    margin = z * math.sqrt((p * (1 - p) / total) + (z**2 / (4 * total**2)))
+    # np.sqrt so `successes` can also be an array (e.g. one entry per threshold)
+    margin = z * np.sqrt((p * (1 - p) / total) + (z**2 / (4 * total**2)))
     lower = (center - margin) / denom
     upper = (center + margin) / denom
     return p, lower, upper
 
 
-def summarize_detection_ci(rows, thresholds=(0.05, 0.1, 0.2)):
-    clean = [r for r in rows if r["label"] == "clean"]
+def summarize_detection_ci(table, thresholds=(0.05, 0.1, 0.2)):
+    counts = label_counts(table)
     payload_labels = ["5percent", "10percent", "25percent"]
+    above = counts_at_or_above(table, "suspicious_score", thresholds)
 
     print("\n=== 95% Confidence Intervals for Detection Rates ===")
 
-    for thresh in thresholds:
+    for i, thresh in enumerate(thresholds):
         print(f"\nThreshold = {thresh:.2f}")
 
         # Clean false positives
-        fp = sum(r["suspicious_score"] >= thresh for r in clean)
-        p, lo, hi = ci_wilson(fp, len(clean))
+        p, lo, hi = ci_wilson(int(above[CLEAN, i]), int(counts[CLEAN]))
         print(f"  Clean FPR: {p:.3f}, CI=({lo:.3f}, {hi:.3f})")
 
         # Per-payload TPRs
         for pl in payload_labels:
-            subset = [r for r in rows if r["label"] == pl]
-            tp = sum(r["suspicious_score"] >= thresh for r in subset)
-            p, lo, hi = ci_wilson(tp, len(subset))
+            code = LABELS.index(pl)
+            p, lo, hi = ci_wilson(int(above[code, i]), int(counts[code]))
             print(f"  {pl:10s} TPR: {p:.3f}, CI=({lo:.3f}, {hi:.3f})")
 
 
-def main():
-    OUTPUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    rows = []
+# --- ROC / threshold sweep ---
 
-    # --- Pass 1: collect raw metrics for all images ---
+def threshold_sweep(table, column="suspicious_score"):
+    """
+    Flag images with column >= threshold, for every distinct threshold.
+    Sorts the scores once (descending) and takes cumulative per-label
+    counts, so the whole sweep is O(n log n).
+    Returns (thresholds, flagged) where flagged is a (labels x thresholds)
+    count matrix; the first column is the "flag nothing" point (+inf).
+    """
+    order = np.argsort(-table[column], kind="stable")
+    scores = table[column][order]
+    codes = table["label"][order]
 
-    # Process clean images
-    for img in CLEAN_DIR.glob("*.png"):
-        rows.append(process_image(img, "clean"))
+    # Last position of each run of equal scores = one distinct threshold
+    last = np.flatnonzero(np.append(scores[1:] != scores[:-1], True))
 
-    # Process each stego payload directory
-    for folder in ["5percent", "10percent", "25percent"]:
-        path = STEGO_DIR / folder
-        for img in path.glob("*.png"):
-            rows.append(process_image(img, folder))
+    flagged = np.zeros((len(LABELS), len(last) + 1), dtype=np.int64)
+    for code in range(len(LABELS)):
+        flagged[code, 1:] = np.cumsum(codes == code)[last]
 
-    if not rows:
-        print("No images processed, CSV not written.")
+    thresholds = np.concatenate([[np.inf], scores[last]])
+    return thresholds, flagged
+
+
+def roc_auc(fpr, tpr):
+    """Area under a ROC curve by the trapezoid rule, from its first (0, 0) point."""
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def summarize_roc(table, target_fprs=TARGET_FPRS):
+    counts = label_counts(table)
+    n_clean = int(counts[CLEAN])
+    n_stego = int(counts.sum() - n_clean)
+    payload_labels = ["5percent", "10percent", "25percent"]
+
+    if not n_clean or not n_stego:
+        print("\n[ROC] Not enough data to compute (need both clean and stego).")
         return
 
-    # --- Pass 2: compute raw suspicious scores by comparing to clean baseline ---
+    thresholds, flagged = threshold_sweep(table)
 
-    groups: dict[str, dict[str, int]] = defaultdict(dict)
+    fp = flagged[CLEAN]
+    tp = flagged.sum(axis=0) - fp
+    fpr, fpr_lo, fpr_hi = ci_wilson(fp, n_clean)
+    tpr, tpr_lo, tpr_hi = ci_wilson(tp, n_stego)
 
-    for idx, row in enumerate(rows):
-        fname = row["filename"]
-        label = row["label"]
-        base = get_base_name(fname)
-        groups[base][label] = idx
+    auc = roc_auc(fpr, tpr)
+    aucs = {"all": auc}
 
-    # Initialize raw suspicious scores to 0 for all images (clean or unmatched)
-    for row in rows:
-        row["raw_suspicious_score"] = 0.0
+    columns = {
+        "threshold": thresholds, "fp": fp, "fpr": fpr, "fpr_lo": fpr_lo, "fpr_hi": fpr_hi,
+        "tp": tp, "tpr": tpr, "tpr_lo": tpr_lo, "tpr_hi": tpr_hi,
+    }
+    for pl in payload_labels:
+        code = LABELS.index(pl)
+        p, lo, hi = ci_wilson(flagged[code], int(counts[code]))
+        columns[f"tp_{pl}"] = flagged[code]
+        columns[f"tpr_{pl}"] = np.broadcast_to(p, fp.shape)
+        columns[f"tpr_{pl}_lo"] = np.broadcast_to(lo, fp.shape)
+        columns[f"tpr_{pl}_hi"] = np.broadcast_to(hi, fp.shape)
+        aucs[pl] = roc_auc(fpr, p) if counts[code] else None
+
+    with open(ROC_CSV, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns.keys())
+        writer.writerows(zip(*(col.tolist() for col in columns.values())))
+
+    # The AUCs of the overall and per-payload curves, for make_graphs
+    with open(ROC_AUC_JSON, "w") as f:
+        json.dump(aucs, f, indent=2)
+
+    print("\n=== ROC (using suspicious_score) ===")
+    print(f"Distinct thresholds: {len(thresholds) - 1}")
+    print(f"AUC: {auc:.4f}")
+
+    # Operating points: the lowest threshold whose FPR stays within each target
+    for target in target_fprs:
+        i = int(np.searchsorted(fpr, target, side="right")) - 1
+        print(f"\nFPR <= {target:.2f}: threshold={thresholds[i]:.4f}, "
+              f"FPR={fpr[i]:.3f}, TPR={tpr[i]:.3f}, CI=({tpr_lo[i]:.3f}, {tpr_hi[i]:.3f})")
+        for pl in payload_labels:
+            code = LABELS.index(pl)
+            p, lo, hi = ci_wilson(int(flagged[code, i]), int(counts[code]))
+            print(f"  {pl:10s} TPR: {p:.3f}, CI=({lo:.3f}, {hi:.3f})")
 
-    # For each base name that has a clean version, compare its stego variants
-    for base, labels_dict in groups.items():
-        if "clean" not in labels_dict:
+    print("\nROC sweep written →", ROC_CSV, "(AUCs →", ROC_AUC_JSON.name + ")")
+
+
+def corpus_roots():
+    """(directory, label) pairs; everything below a directory gets its label."""
+    return [(CLEAN_DIR, "clean")] + [
+        (STEGO_DIR / folder, folder) for folder in ["5percent", "10percent", "25percent"]
+    ]
+
+
+def collect_tasks(rescan=False):
+    """
+    List every (image_path, label, known) task to analyze, in the order
+    the rows end up in the CSV. `known` is the manifest's (size, mtime_ns,
+    sha256) of the file, so the feature cache does not hash it again. The corpus directories are walked recursively and
+    files are recognized by their magic bytes (corpus.sniff_image), not
+    their extension; the result is kept in an incrementally updated
+    manifest (MANIFEST_DB), so re-runs only list changed directories.
+    rescan=True stats every file, to catch images edited in place.
+    Pass 2 matches images by base name (get_base_name), so only the first
+    image of each label and base name is kept (e.g. when both img001.png
+    and img001.npy exist); the others are reported and skipped.
+    """
+    roots = corpus_roots()
+    with profiling.stage("collect_tasks"), CorpusManifest(MANIFEST_DB) as manifest:
+        stats = manifest.scan(roots, full=rescan)
+        images = manifest.images(roots)
+
+    print(
+        f"Corpus manifest: {len(images)} images, {stats['files_indexed']} files (re)indexed, "
+        f"{stats['dirs_listed']} directories listed, {stats['dirs_skipped']} unchanged"
+    )
+
+    tasks = []
+    seen = {}
+    for row in images:
+        path = Path(row["path"])
+        key = (row["label"], get_base_name(path.name))
+        if key in seen:
+            print(f"Skipping {path}: same base name as {seen[key]}")
             continue
+        seen[key] = path
+        tasks.append((path, row["label"], (row["size"], row["mtime_ns"], row["sha256"])))
+    return tasks
 
-        clean_idx = labels_dict["clean"]
-        clean_row = rows[clean_idx]
 
-        clean_sp = clean_row["SP_dev_from_0_5"]
-        clean_chi = clean_row["chi_mean"]
-        clean_rs = clean_row["RS_mean"]
+def task_key(path):
+    """
+    Key of an image in RAW_CSV: its path relative to the project plus its
+    size and mtime, so an image edited in place is analyzed again.
+    """
+    st = Path(path).stat()
+    rel = Path(path).resolve().relative_to(PROJECT).as_posix()
+    return rel, str(st.st_size), str(st.st_mtime_ns)
 
-        for stego_label in ["5percent", "10percent", "25percent"]:
-            if stego_label not in labels_dict:
+
+def iter_rows(tasks, workers=None, chunksize=None, cache=None,
+              prefetch=PREFETCH_DEPTH, prefetch_bytes=PREFETCH_MAX_BYTES, stats=None):
+    """
+    Run process_image over all tasks, in a process pool when workers > 1,
+    yielding each row as soon as it (and every row before it) is done.
+    Images are analyzed in batches (process_batch) of `chunksize` images,
+    ANALYSIS_BATCH by default, each batch going to one worker.
+    Serially, a PrefetchLoader reads and decodes up to `prefetch` images
+    (and at most prefetch_bytes of decoded pixels) ahead of the analysis
+    in background threads; prefetch=0 loads each batch when it is due.
+    With workers > 1 there is no loader: each worker loads its own
+    batches, and its reads already overlap with the other workers'
+    analysis. Pass workers=1 to prefetch on a multi-core machine.
+    Rows come back in task order no matter which worker finishes first.
+    When profiling with --profile-top, batches hold one image by default
+    so each image gets its own cProfile dump.
+    With a FeatureCache, images whose content and detector settings are
+    unchanged are read from the cache instead of being analyzed again.
+    Images that cannot be read are reported and yield None.
+    A `stats` dict gets the number of worker processes actually used
+    ("workers"; 1 when everything came from the cache).
+    """
+    cached = [None] * len(tasks)
+    digests = [None] * len(tasks)
+    fp = feature_fingerprint()
+
+    pending = []
+    for i, (path, label, known) in enumerate(tasks):
+        if cache is not None:
+            digests[i] = cache.content_hash(path, known=known)
+            features = cache.get(digests[i], fp)
+            if features is not None:
+                cached[i] = {"filename": path.name, "label": label, **features}
                 continue
+        pending.append(i)
+
+    if cache is not None:
+        print(f"Feature cache: {len(tasks) - len(pending)} hits, {len(pending)} to compute")
+
+    run_batch = process_batch_profiled if profiling.enabled() else process_batch
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(pending)))
+    if stats is not None:
+        stats["workers"] = workers
+
+    if chunksize is None:
+        chunksize = 1 if profiling.slowest_count() else ANALYSIS_BATCH
+        if workers > 1:
+            # Enough batches to keep every worker busy until the end
+            chunksize = max(1, min(chunksize, len(pending) // (workers * 4)))
+    batches = [pending[i:i + chunksize] for i in range(0, len(pending), chunksize)]
+    paths = [[tasks[i][0] for i in batch] for batch in batches]
+    labels = [[tasks[i][1] for i in batch] for batch in batches]
+
+    pool = None
+    loader = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=profiling.reset)
+    elif prefetch > 0:
+        loader = PrefetchLoader(
+            [tasks[i][0] for i in pending], try_load_input,
+            depth=prefetch, max_bytes=prefetch_bytes,
+        )
+
+    with pool or nullcontext(), loader or nullcontext():
+        if pool is not None:
+            computed = pool.map(run_batch, paths, labels)
+        elif loader is not None:
+            loaded = iter(loader)
+            computed = (
+                run_batch(p, l, inputs=[data for _, data in islice(loaded, len(p))])
+                for p, l in zip(paths, labels)
+            )
+        else:
+            computed = map(run_batch, paths, labels)
+        if run_batch is process_batch_profiled:
+            computed = merge_profiled(computed)
+        computed = chain.from_iterable(computed)
+
+        n_computed = 0
+        for i in range(len(tasks)):
+            row = cached[i]
+            if row is None:
+                row = next(computed)
+                n_computed += 1
+                if cache is not None and row is not None:
+                    features = {k: v for k, v in row.items() if k not in ("filename", "label")}
+                    cache.put(digests[i], fp, features)
+                    if n_computed % STREAM_BATCH == 0:
+                        cache.commit()
+            yield row
+
+    if loader is not None:
+        prefetch_stats = loader.stats
+        print(f"Prefetch: analysis waited {prefetch_stats['wait_s']:.2f}s for image loads "
+              f"({prefetch_stats['waits']} of {prefetch_stats['loaded']} images not ready)")
+
+    if cache is not None:
+        cache.commit()
+
+
+def process_all(tasks, workers=None, chunksize=None, cache=None, stats=None, **prefetch):
+    """All rows of iter_rows, as a list in task order, without unreadable images."""
+    rows = iter_rows(tasks, workers=workers, chunksize=chunksize, cache=cache, stats=stats, **prefetch)
+    return [row for row in rows if row is not None]
+
+
+def stream_all(tasks, workers=None, chunksize=None, cache=None, spill=False, stats=None, **prefetch):
+    """
+    Append each image's raw features to RAW_CSV as it completes, skipping
+    images already recorded there, unchanged, by an earlier (possibly
+    interrupted) run, then load the results table back from the file.
+    Rows of images since edited or removed stay in the log but are not
+    loaded.
+    """
+    keys = [task_key(path) for path, _, _ in tasks]
+    with RawFeatureLog(RAW_CSV, feature_fingerprint(), batch_size=STREAM_BATCH) as log:
+        todo = [i for i, key in enumerate(keys) if key not in log.done]
+        print(f"Raw feature log: {len(tasks) - len(todo)} already recorded, {len(todo)} to add")
 
-            stego_idx = labels_dict[stego_label]
-            stego_row = rows[stego_idx]
+        rows = iter_rows(
+            [tasks[i] for i in todo], workers=workers, chunksize=chunksize, cache=cache,
+            stats=stats, **prefetch
+        )
+        # rows goes first so zip runs the generator to its end (cache commit,
+        # pool and loader shutdown) instead of stopping after the last task
+        for row, i in zip(rows, todo):
+            if row is not None:
+                log.append(keys[i], row)
 
-            stego_sp = stego_row["SP_dev_from_0_5"]
-            stego_chi = stego_row["chi_mean"]
-            stego_rs = stego_row["RS_mean"]
+    return load_raw_table(RAW_CSV, keep=set(keys), spill_path=RESULTS_NPY if spill else None)
+
+
+def analyze_pixel_covers(paths, cache=None):
+    """
+    Pixel-domain rows of clean images, whatever JPEG_DOMAIN says: a stego
+    image saved in pixels (PNG, .npy) from a JPEG cover is compared with
+    the cover's decoded pixels, not with its DCT coefficients. Cached
+    under the fingerprint of JPEG_DOMAIN = "pixel", so such a run shares
+    the entries.
+    """
+    fp = feature_fingerprint(jpeg_domain="pixel")
+    rows = [None] * len(paths)
+    digests = [None] * len(paths)
+    todo = []
+    for i, path in enumerate(paths):
+        if cache is not None:
+            digests[i] = cache.content_hash(path)
+            features = cache.get(digests[i], fp)
+            if features is not None:
+                rows[i] = {"filename": path.name, "label": LABELS[CLEAN], **features}
+                continue
+        todo.append(i)
 
-            # Deltas: how far has this stego image moved away from its clean baseline
-            sp_delta = max(clean_sp - stego_sp, 0.0)
-            chi_delta = max(clean_chi - stego_chi, 0.0)
-            rs_delta = max(clean_rs - stego_rs, 0.0)
+    if todo:
+        computed = process_batch(
+            [paths[i] for i in todo], [LABELS[CLEAN]] * len(todo),
+            inputs=[load_image(paths[i]) for i in todo],
+        )
+        for i, row in zip(todo, computed):
+            rows[i] = row
+            if cache is not None:
+                cache.put(digests[i], fp, {k: v for k, v in row.items() if k not in ("filename", "label")})
+    return rows
 
-            # Weighted combination into a raw suspicious score
-            raw_score = 0.5 * sp_delta + 0.3 * chi_delta + 0.2 * rs_delta
-            rows[stego_idx]["raw_suspicious_score"] = raw_score
+
+def report_throughput(tasks, elapsed, workers):
+    n_images = len(tasks)
+    total_mb = sum(path.stat().st_size for path, _, _ in tasks) / 1e6
+    elapsed = max(elapsed, 1e-9)
+
+    print("\n=== Throughput ===")
+    print(f"Workers: {workers}")
+    print(f"Images:  {n_images} in {elapsed:.2f}s")
+    print(f"Rate:    {n_images / elapsed:.1f} images/sec, {total_mb / elapsed:.2f} MB/sec")
+
+
+def main(workers=None, chunksize=None, use_cache=True, spill=False, stream=False, rescan=False,
+         prefetch=PREFETCH_DEPTH, prefetch_bytes=PREFETCH_MAX_BYTES):
+    OUTPUT_CSV.parent.mkdir(parents=True, exist_ok=True)
+
+    # --- Pass 1: collect raw metrics for all images ---
+
+    tasks = collect_tasks(rescan=rescan)
+    loading = {"prefetch": prefetch, "prefetch_bytes": prefetch_bytes}
+    run_stats = {"workers": 1}
+    start = time.perf_counter()
+    with profiling.stage("pass1_features"):
+        with FeatureCache(CACHE_DB) if use_cache else nullcontext() as cache:
+            if stream:
+                # Raw features go to disk as they complete; the table is
+                # then read back from RAW_CSV (memory-mapped with --spill)
+                table = stream_all(
+                    tasks, workers=workers, chunksize=chunksize, cache=cache, spill=spill,
+                    stats=run_stats, **loading
+                )
+            else:
+                rows = process_all(
+                    tasks, workers=workers, chunksize=chunksize, cache=cache, stats=run_stats, **loading
+                )
+                # Pack results into a columnar table (memory-mapped with --spill)
+                table = build_table(rows, spill_path=RESULTS_NPY if spill else None)
+                del rows
+    pass1_elapsed = time.perf_counter() - start
+
+    if not len(table):
+        print("No images processed, CSV not written.")
+        return
+
+    # --- Pass 2: compute raw suspicious scores by comparing to clean baseline ---
+
+    with profiling.stage("pass2_match", table.nbytes):
+        codes = table["label"]
+        bases = [get_base_name(fname) for fname in table["filename"].tolist()]
+
+        clean_index = {}
+        for idx, (base, code) in enumerate(zip(bases, codes.tolist())):
+            if code == CLEAN:
+                clean_index[base] = idx
+
+        # Row of each image's clean version (-1 if there is none)
+        match = np.array([clean_index.get(base, -1) for base in bases], dtype=np.int64)
+
+        # Raw scores stay 0 for clean and unmatched images; each stego variant
+        # is compared to its own clean image
+        scored = (codes != CLEAN) & (match >= 0)
+
+        # DCT-domain (JPEG) rows have no RS features, so an image is compared
+        # with its clean version analyzed in the same domain. A stego image
+        # saved in pixels from a JPEG cover gets the cover's pixel features
+        # (analyze_pixel_covers); a JPEG analyzed by its DCT coefficients
+        # has nothing to compare with a pixel-domain clean version
+        dct = np.isnan(table["RS_mean"])
+        cover_dct = dct[np.maximum(match, 0)]
+        mixed = scored & dct & ~cover_dct
+        if mixed.any():
+            print(f"{int(mixed.sum())} images not scored: JPEG analyzed in the DCT domain, "
+                  "clean version in pixels")
+        scored &= ~mixed
+
+        baseline = table[match[scored]]
+        repixel = ~dct[scored] & cover_dct[scored]
+        if repixel.any():
+            covers, which = np.unique(match[scored][repixel], return_inverse=True)
+            clean_paths = {path.name: path for path, label, _ in tasks if label == LABELS[CLEAN]}
+            with FeatureCache(CACHE_DB) if use_cache else nullcontext() as cache:
+                pixel_rows = analyze_pixel_covers(
+                    [clean_paths[name] for name in table["filename"][covers].tolist()], cache=cache
+                )
+            pixel_covers = build_table(pixel_rows)
+            for c in FEATURE_COLUMNS:
+                baseline[c][repixel] = pixel_covers[c][which]
+
+        table["raw_suspicious_score"] = 0.0
+        table["raw_suspicious_score"][scored] = raw_suspicious_score(table[scored], baseline)
 
     # --- Pass 3: normalize raw suspicious scores into [0, 1] and add z-score ---
 
-    raw_scores = [row["raw_suspicious_score"] for row in rows]
-    min_raw = min(raw_scores)
-    max_raw = max(raw_scores)
-    print("max raw is", max_raw)
-
-    if max_raw > min_raw:
-        for row in rows:
-            raw = row["raw_suspicious_score"]
-            norm = (raw - min_raw) / (max_raw - min_raw)
-            row["suspicious_score"] = float(norm)
-    else:
-        for row in rows:
-            row["suspicious_score"] = 0.0
-
-    scores = [row["suspicious_score"] for row in rows]
-    mean_score = statistics.mean(scores)
-    std_score = statistics.pstdev(scores) if len(scores) > 1 else 0.0
-
-    for row in rows:
+    with profiling.stage("pass3_normalize", table.nbytes):
+        raw_scores = table["raw_suspicious_score"]
+        min_raw = float(raw_scores.min())
+        max_raw = float(raw_scores.max())
+        print("max raw is", max_raw)
+
+        # Save the clean-corpus baseline (and this run's max raw score as the
+        # normalizer) for scoring single images with suspicious_score
+        clean_rows = table[codes == CLEAN]
+        if len(clean_rows):
+            save_baseline_profile(build_baseline_profile(clean_rows, max_raw, budget=BIT_BUDGET))
+
+        if max_raw > min_raw:
+            table["suspicious_score"] = (raw_scores - min_raw) / (max_raw - min_raw)
+        else:
+            table["suspicious_score"] = 0.0
+
+        scores = table["suspicious_score"]
+        mean_score = scores.mean()
+        std_score = scores.std() if len(scores) > 1 else 0.0
+
         if std_score > 0.0:
-            z = (row["suspicious_score"] - mean_score) / std_score
+            table["susp_z"] = (scores - mean_score) / std_score
         else:
-            z = 0.0
-        row["susp_z"] = float(z)
+            table["susp_z"] = 0.0
 
     # --- Summaries for report ---
 
-    summarize_by_label(rows)
-    summarize_detection(rows, thresholds=(0.05, 0.1, 0.2))
-    summarize_detection_per_payload(rows, thresholds=(0.05, 0.1, 0.2))
-    summarize_confidence_intervals(rows)
-    summarize_detection_ci(rows, thresholds=(0.05, 0.1, 0.2))
-
-    # --- Cleanup and write CSV ---
+    with profiling.stage("summaries"):
+        summarize_by_label(table)
+        summarize_detection(table, thresholds=(0.05, 0.1, 0.2))
+        summarize_detection_per_payload(table, thresholds=(0.05, 0.1, 0.2))
+        summarize_confidence_intervals(table)
+        summarize_detection_ci(table, thresholds=(0.05, 0.1, 0.2))
+        summarize_roc(table)
 
-    for row in rows:
-        del row["raw_suspicious_score"]
+    # --- Write CSV ---
 
-    with open(OUTPUT_CSV, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(rows)
+    with profiling.stage("write_csv") as csv_stage:
+        write_csv(table, OUTPUT_CSV)
+        csv_stage.nbytes = OUTPUT_CSV.stat().st_size
 
     print("\nAnalysis complete →", OUTPUT_CSV)
 
+    report_throughput(tasks, pass1_elapsed, run_stats["workers"])
+    profiling.finish("run_analysis")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run LSB steganalysis over the dataset.")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="number of worker processes (default: one per CPU, 1 = serial)",
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=None,
+        help="images analyzed together and handed to a worker at a time (default: auto)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="recompute every image instead of using " + CACHE_DB.name,
+    )
+    parser.add_argument(
+        "--spill", action="store_true",
+        help="keep the results table in a memory-mapped " + RESULTS_NPY.name + " instead of RAM",
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="append raw features to " + RAW_CSV.name + " as images complete and resume from it",
+    )
+    parser.add_argument(
+        "--rescan", action="store_true",
+        help="stat every corpus file instead of only those in changed directories",
+    )
+    parser.add_argument(
+        "--prefetch", type=int, default=PREFETCH_DEPTH,
+        help=f"images read and decoded ahead of the analysis (default: {PREFETCH_DEPTH}, 0 = off); "
+             "only used with --workers 1, since worker processes load their own images",
+    )
+    parser.add_argument(
+        "--prefetch-mb", type=int, default=PREFETCH_MAX_BYTES >> 20,
+        help=f"memory cap for prefetched images, in MB (default: {PREFETCH_MAX_BYTES >> 20})",
+    )
+    parser.add_argument(
+        "--profile", nargs="?", const="json", choices=profiling.PROFILE_FORMATS,
+        help=f"time every pipeline stage and export the counters to {profiling.PROFILE_DIR.name}/ "
+             f"as JSON or Prometheus text (default: json; also set by ${profiling.PROFILE_ENV})",
+    )
+    parser.add_argument(
+        "--profile-top", type=int, default=0,
+        help="with --profile, keep cProfile dumps of the N slowest images (analyzed one per batch)",
+    )
+    args = parser.parse_args()
+
+    if args.profile or args.profile_top:
+        profiling.enable(args.profile, args.profile_top or None)
+
+    main(
+        workers=args.workers,
+        chunksize=args.chunksize,
+        use_cache=not args.no_cache,
+        spill=args.spill,
+        stream=args.stream,
+        rescan=args.rescan,
+        prefetch=args.prefetch,
+        prefetch_bytes=args.prefetch_mb << 20,
+    )
 
@@ -0,0 +1,71 @@
+import argparse
+import csv
+import time
+from pathlib import Path
+
+from detect_lsb import TRIAGE_THRESHOLD, triage_report
+from run_analysis import PROJECT, analyze_dct, collect_tasks
+
+TRIAGE_CSV = PROJECT / "results" / "triage_results.csv"
+
+TRIAGE_COLUMNS = [
+    "filename", "label", "triage_score", "escalated", "suspicious_score",
+    "bytes_read", "bytes_decoded", "bytes_full",
+]
+
+
+def main(paths=None, threshold=TRIAGE_THRESHOLD):
+    """
+    Triage every image (the dataset by default) and report how much was
+    read and decoded compared with fully decoding every image.
+    """
+    if paths:
+        tasks = [(Path(p), "", None) for p in paths]
+    else:
+        tasks = collect_tasks()
+
+    rows = []
+    start = time.perf_counter()
+    for path, label, _ in tasks:
+        report = triage_report(path, threshold=threshold, analyze_dct=analyze_dct)
+        rows.append({"filename": path.name, "label": label, **report})
+    elapsed = time.perf_counter() - start
+
+    TRIAGE_CSV.parent.mkdir(parents=True, exist_ok=True)
+    with open(TRIAGE_CSV, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TRIAGE_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    if not rows:
+        print("No images found.")
+        return
+
+    escalated = sum(r["escalated"] for r in rows)
+    file_bytes = sum(path.stat().st_size for path, _, _ in tasks)
+    read = sum(r["bytes_read"] for r in rows)
+    decoded = sum(r["bytes_decoded"] for r in rows)
+    full = sum(r["bytes_full"] for r in rows)
+
+    print("\n=== Triage ===")
+    print(f"Images:    {len(rows)} in {elapsed:.2f}s, threshold {threshold}")
+    print(f"Escalated: {escalated} ({escalated / len(rows):.1%}), "
+          f"cleared early: {len(rows) - escalated}")
+    print(f"Read:      {read / 1e6:.2f} MB of {file_bytes / 1e6:.2f} MB on disk ({read / max(file_bytes, 1):.1%})")
+    print(f"Decoded:   {decoded / 1e6:.2f} MB vs {full / 1e6:.2f} MB for full decodes ({decoded / max(full, 1):.1%})")
+    print("\nTriage results written →", TRIAGE_CSV)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quick clean / suspicious triage with early exit.")
+    parser.add_argument(
+        "paths", nargs="*",
+        help="images to triage (default: the whole dataset)",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=TRIAGE_THRESHOLD,
+        help="quick suspicious_score below which an image is cleared without a full analysis",
+    )
+    args = parser.parse_args()
+
+    main(paths=args.paths, threshold=args.threshold)